@@ -0,0 +1,91 @@
+"""Microbenchmark of the flight record transform used by the ingest.
+
+Compares the old cleaning loop (dict comprehension over Flights columns + new
+dict per record) with ingest.clean_flights on a synthetic OpenSky payload.
+Needs the data_collector requirements installed, not the database.
+
+    python benchmarks/bench_transform.py [number_of_records]
+"""
+import os
+import sys
+import time
+import random
+from datetime import datetime
+import sqlalchemy as sa
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+from ingest import clean_flights
+
+AIRPORTS = ["LIRF", "LIMC", "EDDF", "EGLL", "LFPG", "LEMD", "EHAM", "LSZH", None]
+
+
+def synthetic_payload(n):
+    # same shape as the records returned by /flights/departure and /flights/arrival
+    random.seed(42)
+    now = int(time.time())
+    payload = []
+
+    for i in range(n):
+        first_seen = now - random.randint(0, 86400)
+        payload.append({
+            "icao24": f"{i % 0xffffff:06x}",
+            "firstSeen": first_seen,
+            "estDepartureAirport": random.choice(AIRPORTS),
+            "lastSeen": first_seen + random.randint(1800, 36000),
+            "estArrivalAirport": random.choice(AIRPORTS),
+            "callsign": f"AZA{i % 10000:<5}",
+            "estDepartureAirportHorizDistance": 1000,
+            "estDepartureAirportVertDistance": 100,
+            "estArrivalAirportHorizDistance": 1000,
+            "estArrivalAirportVertDistance": 100,
+            "departureAirportCandidatesCount": 1,
+            "arrivalAirportCandidatesCount": 1
+        })
+
+    return payload
+
+
+#Flights table when the old loop was written: the model now stores ids (see lookups), the old loop is measured as it was
+LEGACY_FLIGHTS = sa.Table(
+    'flights', sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('icao24', sa.CHAR(6)),
+    sa.Column('firstSeen', sa.DateTime),
+    sa.Column('estDepartureAirport', sa.CHAR(4)),
+    sa.Column('lastSeen', sa.DateTime),
+    sa.Column('estArrivalAirport', sa.String(4)),
+    sa.Column('callsign', sa.CHAR(8))
+)
+
+
+def legacy_clean(result):
+    # cleaning loop of fetch_and_update_db before the precompiled transform
+    clean_result = []
+
+    for r in result:
+        if r.get('estDepartureAirport') and r.get('estArrivalAirport'):
+            flight = {k: v for k, v in r.items() if k in LEGACY_FLIGHTS.columns.keys()}
+
+            flight['firstSeen'] = datetime.fromtimestamp(flight['firstSeen'])
+            flight['lastSeen'] = datetime.fromtimestamp(flight['lastSeen'])
+
+            clean_result.append(flight)
+
+    return clean_result
+
+
+def run(name, function, payload):
+    start = time.perf_counter()
+    rows = function(payload)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} {len(rows):>9} rows  {elapsed:7.3f}s  {len(payload) / elapsed:>12,.0f} records/s")
+    return elapsed
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    payload = synthetic_payload(n)
+
+    before = run("before", legacy_clean, payload)
+    after = run("after", lambda p: list(clean_flights(p)), payload)
+    print(f"speedup    {before / after:.1f}x")
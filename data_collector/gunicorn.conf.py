@@ -0,0 +1,20 @@
+import os
+import multiprocessing
+
+# gunicorn -c gunicorn.conf.py app:app
+# the app is imported once by the master (preload_app) and every worker initializes
+# its own connections, scheduler and grpc channel after the fork (post_fork)
+
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+bind = f"0.0.0.0:{os.getenv('DATA_COLLECTOR_PORT', 5000)}"
+
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+preload_app = True
+
+
+def post_fork(server, worker):
+    from app import init_worker
+    init_worker()
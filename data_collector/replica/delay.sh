@@ -0,0 +1,7 @@
+# eseguito dall'entrypoint di mariadb alla prima inizializzazione della replica (docker-compose.replica.yaml):
+# la replica applica le modifiche del primario con REPLICA_DELAY secondi di ritardo
+docker_process_sql --database=mysql <<-EOSQL
+	STOP REPLICA;
+	CHANGE MASTER TO MASTER_DELAY=${REPLICA_DELAY:-0};
+	START REPLICA;
+EOSQL
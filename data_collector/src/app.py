@@ -1,20 +1,31 @@
 import os
-from flask import Flask, request, jsonify, g
+import click
+from flask import Flask, Response, request, jsonify, g, stream_with_context
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from sqlalchemy import func
 import requests
 from extensions import db, scheduler
-from models import AirportsOfInterest, Flights
+from models import AirportsOfInterest, Airports
 import tasks
+import rollups
+import jobs
+import query_cache
+import demand
+import history
+import lookups
+import schema
+import partitions
+import db_routing
+from auth_cache import EmailValidationCache
 import grpc
 import sys
+import fcntl
 from datetime import datetime, timedelta
 import redis
 import json
-from sqlalchemy import func
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "grpc_generated"))
-import user_service_pb2, user_service_pb2_grpc
+import user_service_pb2
+import user_client
 
 app = Flask(__name__)
 
@@ -28,6 +39,13 @@ db_name = os.getenv('FLIGHTSDB_DATABASE')
 SQLALCHEMY_DATABASE_URI = f"mysql+pymysql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
 app.config["SQLALCHEMY_DATABASE_URI"] = SQLALCHEMY_DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+#optional read replica of flights_db, the reads are routed to it by db_routing.RoutingSession
+FLIGHTSDB_REPLICA_URI = os.getenv('FLIGHTSDB_REPLICA_URI')
+
+if FLIGHTSDB_REPLICA_URI:
+    app.config['SQLALCHEMY_BINDS'] = {db_routing.REPLICA_BIND: FLIGHTSDB_REPLICA_URI}
+
 db.init_app(app)
 
 with app.app_context():
@@ -41,6 +59,9 @@ email_check_cache = redis.Redis(
     decode_responses = True
 )
 
+#validation results by email, in memory and on redis
+email_validation_cache = EmailValidationCache(email_check_cache)
+
 requests_cache = redis.Redis(
     host=os.getenv('REDIS_HOST', 'data-cache'),
     port=int(os.getenv('REDIS_PORT', 6379)),
@@ -50,27 +71,37 @@ requests_cache = redis.Redis(
 
 #setup scheduler
 scheduler.init_app(app)
-scheduler.start()
 
+#only the process holding this file lock runs the scheduler
+SCHEDULER_LOCK_FILE = os.getenv('SCHEDULER_LOCK_FILE', '/tmp/data_collector_scheduler.lock')
+scheduler_lock = None
+
+def acquire_scheduler_lock():
+    global scheduler_lock
 
-#setup grpc channel
-service_config = """{
-    "methodConfig": [{
-        "name": [{"service": "CheckUserService"}],
-        "retryPolicy": {
-            "maxAttempts": 3,
-            "initialBackoff": "0.5s",
-            "maxBackoff": "3s",
-            "backoffMultiplier": 2,
-            "retryableStatusCodes": ["UNAVAILABLE"]
-        },
-        "timeout": "5s"
-    }]
-}"""
+    lock_file = open(SCHEDULER_LOCK_FILE, 'w')
 
-options = [('grpc.service_config', service_config)]
-channel = grpc.insecure_channel('user-manager:50051', options=options)
-stub = user_service_pb2_grpc.CheckUserServiceStub(channel)
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+
+    # the file stays open: the kernel releases the lock when the process dies, and a new worker takes it
+    scheduler_lock = lock_file
+    return True
+
+def init_worker():
+    # per-process init, called by gunicorn after the fork (post_fork) or by __main__.
+    # db connections opened by the master are discarded, redis pools reset themselves on fork,
+    # the grpc channel is created on first use by user_client
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+    if acquire_scheduler_lock():
+        scheduler.start()
+        partitions.run_at_start()
 
 
 #middleware
@@ -89,20 +120,31 @@ def email_check():
     if not g.email:
         return jsonify({"error": "Header 'X-User-Email' missing"}), 400
     
-    cache_key = f"{g.client_id}:{g.request_id}"
-    cached_data = email_check_cache.get(cache_key)
+    #hot path: the email was validated recently by this process
+    packet = email_validation_cache.get_local(g.email)
 
-    if cached_data: 
-        cached_json = json.loads(cached_data)
+    if packet is None:
+        cache_key = f"{g.client_id}:{g.request_id}"
+        cached_data = email_check_cache.get(cache_key)
 
-        if cached_json["status_code"] == 200:
+        if cached_data: 
+            cached_json = json.loads(cached_data)
+
+            if cached_json["status_code"] == 200:
+                return None
+                
+            return jsonify(cached_json['body']), cached_json['status_code']
+
+        packet = email_validation_cache.get(g.email)
+
+    if packet is not None:
+        if packet["status_code"] == 200:
             return None
-            
-        return jsonify(cached_json['body']), cached_json['status_code']
 
+        return jsonify(packet['body']), packet['status_code']
 
     try:
-        response = stub.CheckUserExists(
+        response = user_client.get_stub().CheckUserExists(
             user_service_pb2.UserCheckRequest(email = g.email),
             timeout=5
         )
@@ -117,13 +159,16 @@ def email_check():
             "status_code": 200
         }
 
-        if response.status == 0:
-            email_check_cache.setex(cache_key, 300, json.dumps(cache_packet))
-            return None
-        else:
+        if response.status != 0:
             cache_packet["status_code"] = 401
-            email_check_cache.setex(cache_key, 300, json.dumps(cache_packet))
-            return jsonify(response_json), 401
+
+        email_check_cache.setex(cache_key, 300, json.dumps(cache_packet))
+        email_validation_cache.set(g.email, cache_packet)
+
+        if cache_packet["status_code"] == 200:
+            return None
+
+        return jsonify(response_json), 401
                         
     except grpc.RpcError as e:
         print(f"ERROR: {e.code().name} - {e.details()}")
@@ -133,6 +178,31 @@ def email_check():
         }), 503
 
 
+#read/write routing: the requests that can write, and the ones of a client that just wrote, use only the primary
+def sticky_key(client_id):
+    return f"{client_id}:read_primary"
+
+@app.before_request
+def route_database():
+    if not FLIGHTSDB_REPLICA_URI:
+        return None
+
+    if request.method not in ('GET', 'HEAD') or requests_cache.exists(sticky_key(g.client_id)):
+        db.session.info['primary_only'] = True
+
+def read_primary_for_cache(airport):
+    # a response about to be stored in the query cache is read from the primary right after an ingest of the airport
+    if FLIGHTSDB_REPLICA_URI and query_cache.needs_primary(airport):
+        db.session.info['primary_only'] = True
+
+@app.after_request
+def stick_to_primary(response):
+    if FLIGHTSDB_REPLICA_URI and db.session.info.get('wrote'):
+        requests_cache.setex(sticky_key(g.client_id), db_routing.REPLICA_STICKY_SECONDS, 1)
+
+    return response
+
+
 #routes
 @app.route('/airport-of-interest/add', methods=['POST'])
 def add_airports_of_interest():
@@ -149,22 +219,28 @@ def add_airports_of_interest():
 
 
     try:
+        airport_ids = lookups.airports.ids(airports)
+
         for airport in airports:
-            db.session.add(AirportsOfInterest(email=g.email, icao=airport))
+            db.session.add(AirportsOfInterest(email=g.email, airport_id=airport_ids[airport]))
 
         db.session.commit()
 
-        tasks.fetch_and_update_db(airports)
+        #the flights are fetched in background, the client can follow the ingest with /airport-of-interest/jobs/<job_id>
+        ingest_jobs = jobs.enqueue_ingest(airports)
 
-        response_body = {"message": "Airports added"}
+        response_body = {
+            "message": "Airports added",
+            "jobs": ingest_jobs
+        }
         cache_packet = { 
             "body": response_body,
-            "status_code": 201
+            "status_code": 202
         }
 
         requests_cache.setex(cache_key, 300, json.dumps(cache_packet))
 
-        return jsonify(response_body), 201
+        return jsonify(response_body), 202
     
     except IntegrityError as e:
         db.session.rollback()
@@ -190,6 +266,15 @@ def add_airports_of_interest():
             "details": str(e)
         }), 500
 
+@app.route('/airport-of-interest/jobs/<job_id>', methods=['GET'])
+def get_ingest_job(job_id):
+    job = jobs.get_job(job_id)
+
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify(job), 200
+
 @app.route('/get-flights/latest', methods=['GET'])  
 def get_latest_flights():
 
@@ -204,23 +289,33 @@ def get_latest_flights():
 
     if not airport:
         return jsonify({"message": "Parameter 'airport' missing"}), 400
+
+    airport = lookups.normalize_icao(airport)
+    demand.record_read(airport)
+
+    #same query already answered for any client
+    query_key, cached_body = query_cache.lookup('flights_latest', airport, {})
+
+    if cached_body is not None:
+        cache_packet = { 
+            "body": cached_body,
+            "status_code": 200
+        }
+
+        requests_cache.setex(cache_key, 300, json.dumps(cache_packet))
+        return jsonify(cached_body), 200
+
+    read_primary_for_cache(airport)
     
     try:  
-        stmt = db.select(Flights)\
-        .where(Flights.estDepartureAirport == airport)\
-        .order_by(Flights.firstSeen.desc())\
-        .limit(1)
-        last_departure = db.session.execute(stmt).scalars().first()
-
-        stmt = db.select(Flights)\
-        .where(Flights.estArrivalAirport == airport)\
-        .order_by(Flights.lastSeen.desc())\
-        .limit(1)
-        last_arrival = db.session.execute(stmt).scalars().first()
+        stmt = rollups.latest_flights_stmt(lookups.airports.id(airport))
+        latest = db.session.execute(stmt).first() or (None, None)
 
+        #null if the airport has no flights yet
+        last_departure, last_arrival = history.flights_to_dicts(latest)
         response_body = {
-            "last_departure": last_departure.to_dict(),
-            "last_arrival": last_arrival.to_dict()
+            "last_departure": last_departure,
+            "last_arrival": last_arrival
         }
 
         cache_packet = { 
@@ -229,6 +324,7 @@ def get_latest_flights():
         }
 
         requests_cache.setex(cache_key, 300, json.dumps(cache_packet))
+        query_cache.store(query_key, response_body)
         return jsonify(response_body), 200
     
     except requests.exceptions.RequestException as e:
@@ -236,6 +332,61 @@ def get_latest_flights():
             "error": "Error during api call"
         }), 500
 
+@app.route('/get-flights', methods=['GET'])
+def get_flights():
+    # flights of an airport in a direction, optionally in [begin, end) (unix timestamps).
+    # json: one page of limit flights and the cursor of the next one, to pass back as cursor.
+    # ndjson (format=ndjson or Accept: application/x-ndjson): every flight from the cursor on, one per line
+    airport = request.args.get('airport')
+    direction = request.args.get('direction', default='departure')
+    begin = request.args.get('begin', type=int)
+    end = request.args.get('end', type=int)
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    ndjson = request.args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+
+    if not airport:
+        return jsonify({"message": "Parameter 'airport' missing"}), 400
+
+    if direction not in history.DIRECTIONS:
+        return jsonify({"message": "Parameter 'direction' must be 'departure' or 'arrival'"}), 400
+
+    if limit is not None and not 1 <= limit <= history.GET_FLIGHTS_MAX_LIMIT:
+        return jsonify({"message": f"Parameter 'limit' must be between 1 and {history.GET_FLIGHTS_MAX_LIMIT}"}), 400
+
+    try:
+        after = history.decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"message": "Parameter 'cursor' not valid"}), 400
+
+    airport = lookups.normalize_icao(airport)
+    demand.record_read(airport)
+
+    stmt = history.query(
+        lookups.airports.id(airport),
+        direction,
+        datetime.fromtimestamp(begin) if begin is not None else None,
+        datetime.fromtimestamp(end) if end is not None else None,
+        after
+    )
+
+    if ndjson:
+        return Response(stream_with_context(history.stream_ndjson(stmt, limit)), mimetype='application/x-ndjson')
+
+    try:
+        flights, next_cursor = history.get_page(stmt, direction, limit or history.GET_FLIGHTS_DEFAULT_LIMIT)
+    except SQLAlchemyError as e:
+        return jsonify({
+            "error": "Database error",
+            "details": str(e)
+        }), 500
+
+    return jsonify({
+        "flights": flights,
+        "next_cursor": next_cursor
+    }), 200
+
 @app.route('/airport-of-interest/average', methods=['GET'])
 def average():
 
@@ -252,21 +403,35 @@ def average():
     if not airport or not numberOfDays:
         return jsonify({"errore" : " Dati Mancanti. Inserisci l'aeroporto e il numero di giorni"})
 
+    airport = lookups.normalize_icao(airport)
+    demand.record_read(airport)
+
+    query_key, cached_body = query_cache.lookup('flight_average', airport, {"numberOfDays": numberOfDays})
+
+    if cached_body is not None:
+        cache_packet = { 
+            "body": cached_body,
+            "status_code": 200
+        }
+
+        requests_cache.setex(cache_key, 300, json.dumps(cache_packet))
+        return jsonify(cached_body), 200
+
+    read_primary_for_cache(airport)
+
     try: 
         #limit_date è la data dopo il quale dobbiamo cercare i voli. E' uguale alla data di oggi - i giorni scelti dall'utente.
         # il .replace ci consente di partire dalla mezzanotte del giorno limit_date. Senza questo il limit_date aveva l'orario del giorno datetime.now()
         limit_date = (datetime.now() - timedelta(days=numberOfDays)).replace(hour=0, minute=0, second=0, microsecond=0)
         print(f"limit_date {limit_date}")
 
-        departures_count = db.session.query(func.count(Flights.id)).filter(
-            Flights.estDepartureAirport == airport,
-            Flights.firstSeen >= limit_date
-        ).scalar()
+        #the counts are read from the daily rollup: at most numberOfDays + 1 rows, whatever the size of Flights
+        departures_count, arrivals_count = db.session.execute(
+            rollups.daily_counts_stmt(lookups.airports.id(airport), limit_date.date())
+        ).one()
 
-        arrivals_count = db.session.query(func.count(Flights.id)).filter(
-            Flights.estArrivalAirport == airport,
-            Flights.lastSeen >= limit_date
-        ).scalar()
+        departures_count = int(departures_count)
+        arrivals_count = int(arrivals_count)
 
         average_departures = departures_count / numberOfDays
         average_arrivals = arrivals_count / numberOfDays
@@ -286,6 +451,7 @@ def average():
         }
 
         requests_cache.setex(cache_key, 300, json.dumps(cache_packet))
+        query_cache.store(query_key, response_body)
         return jsonify(response_body), 200
 
     except Exception as e:
@@ -295,6 +461,56 @@ def average():
         }), 500
 
 
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    #hits and misses of the query cache for every route
+    return jsonify(query_cache.get_stats()), 200
+
+
+#commands
+@app.cli.command('rebuild-daily-counts')
+def rebuild_daily_counts():
+    # flask --app src/app.py rebuild-daily-counts
+    rollups.rebuild_daily_counts()
+
+@app.cli.command('rebuild-latest-flights')
+def rebuild_latest_flights():
+    # flask --app src/app.py rebuild-latest-flights
+    rollups.rebuild_latest_flights()
+
+@app.cli.command('migrate-schema')
+def migrate_schema():
+    # flask --app src/app.py migrate-schema, rebuilds the tables created before the lookup tables of airports and aircraft
+    schema.migrate_schema()
+
+@app.cli.command('maintain-partitions')
+def maintain_partitions():
+    # flask --app src/app.py maintain-partitions, adds the daily partitions of flights and expires the old ones right away
+    partitions.maintain_partitions()
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    # flask --app src/app.py check-query-plans, exits with 1 if a read route scans a whole table
+    if schema.check_query_plans():
+        raise SystemExit(1)
+
+@app.cli.command('replay-archive')
+@click.argument('airports', nargs=-1)
+@click.option('--begin', type=int, default=None, help="unix timestamp, only windows ending after it")
+@click.option('--end', type=int, default=None, help="unix timestamp, only windows starting before it")
+def replay_archive(airports, begin, end):
+    # flask --app src/app.py replay-archive [AIRPORTS...], without airports every airport of interest is replayed
+    if not airports:
+        airports = db.session.execute(
+            db.select(Airports.icao).join(AirportsOfInterest, AirportsOfInterest.airport_id == Airports.id).distinct()
+        ).scalars().all()
+
+    tasks.fetch_and_update_db(airports, replay=True, replay_begin=begin, replay_end=end)
+
+
 if __name__ == '__main__':
+    #development server, in production the app is served by gunicorn (gunicorn.conf.py)
+    init_worker()
+
     port = int(os.environ.get('DATA_COLLECTOR_PORT', 5000))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
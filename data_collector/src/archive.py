@@ -0,0 +1,118 @@
+import os
+import re
+import gzip
+import time
+import logging
+from json_stream import iter_json_array, decode_utf8
+
+logger = logging.getLogger(__name__)
+
+#directory of the archive of the raw OpenSky responses, empty to disable it
+ARCHIVE_DIR = os.getenv('OPENSKY_ARCHIVE_DIR', '')
+
+# every response is saved as it came from OpenSky, gzip compressed, in
+# ARCHIVE_DIR/<icao>/<direction>/<begin>-<end>.<fetched_at>.json.gz
+# files are never overwritten: a window fetched again gets a new file and replay reads the newest one
+
+#bytes read at a time from an archived file during a replay
+ARCHIVE_READ_SIZE = 64 * 1024
+
+FILE_NAME = re.compile(r'^(\d+)-(\d+)\.(\d+)\.json\.gz$')
+
+def enabled():
+    return bool(ARCHIVE_DIR)
+
+class ArchiveWriter:
+    # gzip file of a response being downloaded: it gets into the archive only if the with block ends
+    # without errors, an interrupted download leaves nothing behind. It does nothing if the archive is disabled
+    def __init__(self, icao, direction, begin, end):
+        self.name = f"{icao} {direction} {begin}-{end}"
+        self.directory = os.path.join(ARCHIVE_DIR, icao, direction)
+        self.path = os.path.join(self.directory, f"{begin}-{end}.{time.time_ns()}.json.gz")
+        self.file = None
+
+    def __enter__(self):
+        if enabled():
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                self.file = gzip.open(self.path + '.tmp', 'wb')
+            except OSError as e:
+                logger.error(f"Error archiving {self.name}: {e}")
+
+        return self
+
+    def write(self, data):
+        if self.file is None:
+            return
+
+        try:
+            self.file.write(data)
+        except OSError as e:
+            logger.error(f"Error archiving {self.name}: {e}")
+            self.discard()
+
+    def discard(self):
+        try:
+            self.file.close()
+            os.remove(self.path + '.tmp')
+        except OSError:
+            pass
+
+        self.file = None
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.file is None:
+            return False
+
+        if exc_type is not None:
+            self.discard()
+            return False
+
+        try:
+            # renamed only when complete, so a replay never reads half a response
+            self.file.close()
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as e:
+            logger.error(f"Error archiving {self.name}: {e}")
+
+        self.file = None
+        return False
+
+def save(icao, direction, begin, end, body):
+    with ArchiveWriter(icao, direction, begin, end) as archived:
+        archived.write(body)
+
+def windows(icao, direction, begin=None, end=None):
+    # newest file of every archived window of icao/direction overlapping [begin, end], oldest window first
+    directory = os.path.join(ARCHIVE_DIR, icao, direction)
+
+    if not os.path.isdir(directory):
+        return []
+
+    latest = {}
+
+    for name in os.listdir(directory):
+        match = FILE_NAME.match(name)
+
+        if not match:
+            continue
+
+        window_begin, window_end, fetched_at = map(int, match.groups())
+
+        if begin is not None and window_end <= begin:
+            continue
+        if end is not None and window_begin >= end:
+            continue
+
+        if latest.get((window_begin, window_end), (0, None))[0] < fetched_at:
+            latest[(window_begin, window_end)] = (fetched_at, os.path.join(directory, name))
+
+    return [(window, path) for window, (_, path) in sorted(latest.items())]
+
+def replay(airports_icao, directions, begin=None, end=None):
+    """Yields the archived records of the airports, one response at a time."""
+    for icao in airports_icao:
+        for direction in directions:
+            for _, path in windows(icao, direction, begin, end):
+                with gzip.open(path, 'rb') as f:
+                    yield from iter_json_array(decode_utf8(iter(lambda: f.read(ARCHIVE_READ_SIZE), b'')))
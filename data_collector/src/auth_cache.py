@@ -0,0 +1,92 @@
+import os
+import time
+import json
+import threading
+from collections import OrderedDict
+
+#seconds a validation result is kept, negative results (user not registered) are kept for less time
+EMAIL_CACHE_TTL = int(os.getenv('EMAIL_CACHE_TTL', 300))
+EMAIL_NEGATIVE_CACHE_TTL = int(os.getenv('EMAIL_NEGATIVE_CACHE_TTL', 30))
+
+#max number of emails kept in memory by every process
+EMAIL_LOCAL_CACHE_SIZE = int(os.getenv('EMAIL_LOCAL_CACHE_SIZE', 10000))
+
+
+class LRUCache:
+    """In-process LRU cache whose entries expire after their ttl."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class EmailValidationCache:
+    """Result of CheckUserExists by email: in-process LRU in front of redis.
+
+    The cached value is the packet replayed by the middleware ({"body", "status_code"}).
+    """
+
+    def __init__(self, redis_client, maxsize=EMAIL_LOCAL_CACHE_SIZE):
+        self.redis = redis_client
+        self.local = LRUCache(maxsize)
+
+    @staticmethod
+    def redis_key(email):
+        return f"email:{email}"
+
+    @staticmethod
+    def ttl(packet):
+        return EMAIL_CACHE_TTL if packet["status_code"] == 200 else EMAIL_NEGATIVE_CACHE_TTL
+
+    def get_local(self, email):
+        return self.local.get(email)
+
+    def get(self, email):
+        packet = self.local.get(email)
+
+        if packet is not None:
+            return packet
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(self.redis_key(email))
+        pipe.ttl(self.redis_key(email))
+        cached_data, remaining = pipe.execute()
+
+        if not cached_data:
+            return None
+
+        packet = json.loads(cached_data)
+        # the local copy doesn't outlive the redis one
+        self.local.set(email, packet, min(self.ttl(packet), remaining) if remaining > 0 else self.ttl(packet))
+
+        return packet
+
+    def set(self, email, packet):
+        ttl = self.ttl(packet)
+        self.redis.setex(self.redis_key(email), ttl, json.dumps(packet))
+        self.local.set(email, packet, ttl)
@@ -0,0 +1,72 @@
+from extensions import scheduler
+import os
+import time
+import socket
+import hashlib
+import logging
+from bisect import bisect
+import redis
+
+logger = logging.getLogger(__name__)
+
+#name of this node in the cluster, one node per data_collector replica (the process running the scheduler)
+NODE_ID = os.getenv('NODE_ID') or f"{socket.gethostname()}:{os.getpid()}"
+
+#a node is alive if its last heartbeat is more recent than NODE_TTL seconds
+NODE_HEARTBEAT_INTERVAL = int(os.getenv('NODE_HEARTBEAT_INTERVAL', 30))
+NODE_TTL = int(os.getenv('NODE_TTL', 90))
+
+#points of every node on the hash ring, more points spread the airports more evenly
+HASH_RING_REPLICAS = 100
+
+cluster_cache = redis.Redis(
+    host=os.getenv('REDIS_HOST', 'data-cache'),
+    port=int(os.getenv('REDIS_PORT', 6379)),
+    db = 4,
+    decode_responses = True
+)
+
+NODES_KEY = "cluster:nodes"
+
+def heartbeat():
+    cluster_cache.zadd(NODES_KEY, {NODE_ID: time.time()})
+
+def live_nodes():
+    # nodes with a recent heartbeat, this one included
+    now = time.time()
+    cluster_cache.zremrangebyscore(NODES_KEY, 0, now - NODE_TTL)
+    nodes = set(cluster_cache.zrangebyscore(NODES_KEY, now - NODE_TTL, now))
+    nodes.add(NODE_ID)
+
+    return sorted(nodes)
+
+def acquire_cycle_lock(name, ttl):
+    """True if this node takes the lock of the current cycle of the job name.
+
+    The lock is never released, it expires after ttl: the other nodes reaching
+    the same job within ttl seconds skip their cycle.
+    """
+    return bool(cluster_cache.set(f"cluster:lock:{name}", NODE_ID, nx=True, ex=ttl))
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+def build_ring(nodes):
+    ring = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(HASH_RING_REPLICAS))
+    return [h for h, _ in ring], [node for _, node in ring]
+
+def owned_airports(airports_icao, nodes, node_id=NODE_ID):
+    # consistent hashing: when a node joins or leaves only the airports of its ring segments move
+    hashes, owners = build_ring(nodes)
+
+    return [
+        icao for icao in airports_icao
+        if owners[bisect(hashes, _hash(icao)) % len(owners)] == node_id
+    ]
+
+@scheduler.task('interval', id='cluster_heartbeat', seconds=NODE_HEARTBEAT_INTERVAL)
+def cluster_heartbeat():
+    try:
+        heartbeat()
+    except redis.RedisError as e:
+        logger.error(f"Heartbeat failed: {e}")
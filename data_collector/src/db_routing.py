@@ -0,0 +1,29 @@
+import os
+import sqlalchemy as sa
+from flask_sqlalchemy.session import Session
+
+#key of the read replica of flights_db in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+#seconds the requests of a client keep reading from the primary after one of its requests wrote to it,
+#so the client reads its own writes even if the replica lags behind
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+class RoutingSession(Session):
+    """Session reading from the replica, when there is one, and writing to the primary.
+
+    Only SELECTs go to the replica: flushes, inserts/updates/deletes, text statements and raw connections go
+    to the primary and set info['wrote'], after which the session reads from the primary too, so it
+    always sees its own writes. info['primary_only'] keeps the whole session on the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self._db.engines.get(REPLICA_BIND)
+
+        if bind is None and replica is not None:
+            if self._flushing or not isinstance(clause, sa.sql.Select):
+                self.info['wrote'] = True
+            elif not self.info.get('wrote') and not self.info.get('primary_only'):
+                return replica
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,115 @@
+from extensions import db
+import os
+import time
+import math
+import logging
+import redis
+from models import AirportsOfInterest, Airports
+from opensky import rate_limiter
+from lookups import normalize_icao
+
+logger = logging.getLogger(__name__)
+
+# every airport is refreshed at an interval that depends on its demand: subscribers plus recent reads
+# of /get-flights/latest and /airport-of-interest/average. Hot airports are refreshed every
+# MIN_REFRESH_INTERVAL, cold ones every MAX_REFRESH_INTERVAL, and the plan is stretched if it
+# doesn't fit OPENSKY_DAILY_CALL_BUDGET.
+# OpenSky publishes the flights once a day (see tasks.settled_until), so there is nothing new to fetch
+# more often than daily: no interval is shorter than a day, and a long one must stay below INGEST_MAX_LOOKBACK
+
+#shortest interval that can fetch new flights
+SETTLED_DATA_PERIOD = 86400
+
+MIN_REFRESH_INTERVAL = max(SETTLED_DATA_PERIOD, int(os.getenv('MIN_REFRESH_INTERVAL', 86400)))
+MAX_REFRESH_INTERVAL = max(MIN_REFRESH_INTERVAL, int(os.getenv('MAX_REFRESH_INTERVAL', 3 * 86400)))
+
+#reads are counted in hourly buckets over the last DEMAND_WINDOW_HOURS hours, READ_WEIGHT reads weigh as one subscriber
+DEMAND_WINDOW_HOURS = int(os.getenv('DEMAND_WINDOW_HOURS', 24))
+READ_WEIGHT = float(os.getenv('READ_WEIGHT', 0.1))
+
+#max OpenSky calls per day spent by the scheduled refresh (a refresh costs one call per direction)
+OPENSKY_DAILY_CALL_BUDGET = int(os.getenv('OPENSKY_DAILY_CALL_BUDGET', 4000))
+CALLS_PER_REFRESH = 2
+
+demand_cache = redis.Redis(
+    host=os.getenv('REDIS_HOST', 'data-cache'),
+    port=int(os.getenv('REDIS_PORT', 6379)),
+    db = 5,
+    decode_responses = True
+)
+
+def reads_key(hour):
+    return f"demand:reads:{hour}"
+
+def record_read(airport):
+    hour = int(time.time() // 3600)
+
+    pipe = demand_cache.pipeline(transaction=False)
+    pipe.hincrby(reads_key(hour), normalize_icao(airport), 1)
+    pipe.expire(reads_key(hour), (DEMAND_WINDOW_HOURS + 1) * 3600)
+    pipe.execute()
+
+def recent_reads(airports_icao):
+    hour = int(time.time() // 3600)
+
+    pipe = demand_cache.pipeline(transaction=False)
+    for h in range(hour - DEMAND_WINDOW_HOURS + 1, hour + 1):
+        pipe.hmget(reads_key(h), airports_icao)
+
+    reads = dict.fromkeys(airports_icao, 0)
+    for bucket in pipe.execute():
+        for icao, count in zip(airports_icao, bucket):
+            if count:
+                reads[icao] += int(count)
+
+    return reads
+
+def subscriber_counts():
+    # {icao: number of subscribers}, one row per distinct airport
+    stmt = db.select(Airports.icao, db.func.count(AirportsOfInterest.id))\
+    .select_from(AirportsOfInterest)\
+    .join(Airports, Airports.id == AirportsOfInterest.airport_id)\
+    .group_by(Airports.icao)
+
+    return dict(db.session.execute(stmt).all())
+
+def demand_scores(subscribers):
+    reads = recent_reads(list(subscribers)) if subscribers else {}
+    return {icao: count + READ_WEIGHT * reads.get(icao, 0) for icao, count in subscribers.items()}
+
+def refresh_intervals(scores):
+    # the interval goes down with the score: 1 subscriber -> MAX_REFRESH_INTERVAL, 3 or more -> MIN_REFRESH_INTERVAL (by default).
+    # scores has to cover every airport of the cluster, also in sharded mode, so the budget is the one of the whole plan
+    intervals = {
+        icao: min(MAX_REFRESH_INTERVAL, max(MIN_REFRESH_INTERVAL, MAX_REFRESH_INTERVAL / max(score, 1)))
+        for icao, score in scores.items()
+    }
+
+    daily_calls = sum(CALLS_PER_REFRESH * 86400 / interval for interval in intervals.values())
+
+    if daily_calls > OPENSKY_DAILY_CALL_BUDGET:
+        # every interval is stretched by the same factor, hot airports stay more frequent than cold ones
+        factor = daily_calls / OPENSKY_DAILY_CALL_BUDGET
+        logger.info(f"--- Refresh plan over budget ({daily_calls:.0f} calls/day), intervals stretched x{factor:.2f} ---")
+        intervals = {icao: interval * factor for icao, interval in intervals.items()}
+
+    return intervals
+
+def due_airports(scores, intervals, last_refresh, now, tick, nodes=1):
+    """Airports whose interval has elapsed since last_refresh ({icao: timestamp}), the most requested first.
+
+    At most the share of the daily budget of one tick (tick seconds) is returned, divided among the
+    nodes refreshing at the same time, and never more than their share of the credits left today.
+    """
+    due = [
+        icao for icao, interval in intervals.items()
+        if last_refresh.get(icao, 0) + interval <= now
+    ]
+    due.sort(key=lambda icao: scores[icao], reverse=True)
+
+    per_tick = max(1, math.floor(OPENSKY_DAILY_CALL_BUDGET * tick / 86400 / CALLS_PER_REFRESH / nodes))
+
+    #never more than what's left of the OpenSky credits of the day
+    per_tick = min(per_tick, rate_limiter.calls_left_today() // CALLS_PER_REFRESH // nodes)
+
+    return due[:per_tick]
@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_apscheduler import APScheduler
+from db_routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 scheduler = APScheduler()
\ No newline at end of file
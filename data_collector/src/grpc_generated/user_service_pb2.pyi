@@ -1,6 +1,8 @@
+from google.protobuf.internal import containers as _containers
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
-from typing import ClassVar as _ClassVar, Optional as _Optional
+from collections.abc import Iterable as _Iterable, Mapping as _Mapping
+from typing import ClassVar as _ClassVar, Optional as _Optional, Union as _Union
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
@@ -11,9 +13,23 @@ class UserCheckRequest(_message.Message):
     def __init__(self, email: _Optional[str] = ...) -> None: ...
 
 class UserCheckResponse(_message.Message):
-    __slots__ = ("status", "message")
+    __slots__ = ("status", "message", "email")
     STATUS_FIELD_NUMBER: _ClassVar[int]
     MESSAGE_FIELD_NUMBER: _ClassVar[int]
+    EMAIL_FIELD_NUMBER: _ClassVar[int]
     status: int
     message: str
-    def __init__(self, status: _Optional[int] = ..., message: _Optional[str] = ...) -> None: ...
+    email: str
+    def __init__(self, status: _Optional[int] = ..., message: _Optional[str] = ..., email: _Optional[str] = ...) -> None: ...
+
+class UsersCheckRequest(_message.Message):
+    __slots__ = ("emails",)
+    EMAILS_FIELD_NUMBER: _ClassVar[int]
+    emails: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, emails: _Optional[_Iterable[str]] = ...) -> None: ...
+
+class UsersCheckResponse(_message.Message):
+    __slots__ = ("results",)
+    RESULTS_FIELD_NUMBER: _ClassVar[int]
+    results: _containers.RepeatedCompositeFieldContainer[UserCheckResponse]
+    def __init__(self, results: _Optional[_Iterable[_Union[UserCheckResponse, _Mapping]]] = ...) -> None: ...
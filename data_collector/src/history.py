@@ -0,0 +1,141 @@
+import os
+import json
+import base64
+import binascii
+from datetime import datetime, timedelta
+from extensions import db
+from models import Flights
+import lookups
+
+# flight history of an airport, read with keyset pagination: departures are sorted by (firstSeen, id),
+# arrivals by (lastSeen, id), and a page starts right after the key of the last flight of the previous one,
+# so every page costs the same however deep it is. Rows are read with the ids of aircraft and airports,
+# translated back to codes a batch of rows at a time
+
+#flights in a page of /get-flights when the client doesn't choose, and the most a client can ask for
+GET_FLIGHTS_DEFAULT_LIMIT = int(os.getenv('GET_FLIGHTS_DEFAULT_LIMIT', 100))
+GET_FLIGHTS_MAX_LIMIT = int(os.getenv('GET_FLIGHTS_MAX_LIMIT', 1000))
+
+#rows fetched at a time from the server-side cursor of the ndjson stream
+GET_FLIGHTS_STREAM_BATCH = int(os.getenv('GET_FLIGHTS_STREAM_BATCH', 1000))
+
+COLUMNS = (
+    Flights.id,
+    Flights.aircraft_id,
+    Flights.firstSeen,
+    Flights.departure_airport_id,
+    Flights.lastSeen,
+    Flights.arrival_airport_id,
+    Flights.callsign
+)
+
+KEYS = tuple(column.key for column in COLUMNS)
+
+#airport and time column of every direction, and position of the time column in a row
+DIRECTIONS = {
+    'departure': (Flights.departure_airport_id, Flights.firstSeen, KEYS.index('firstSeen')),
+    'arrival': (Flights.arrival_airport_id, Flights.lastSeen, KEYS.index('lastSeen'))
+}
+
+#longest flight: a flight landed at lastSeen took off at most this long before
+MAX_FLIGHT_DURATION = timedelta(days=1)
+
+def first_seen_bounds(seen_column, begin=None, end=None):
+    # conditions on firstSeen implied by a range on seen_column: flights are partitioned by firstSeen,
+    # with them a range on lastSeen reads only the partitions of its days
+    if seen_column is Flights.firstSeen:
+        return ()
+
+    conditions = []
+
+    if begin is not None:
+        conditions.append(Flights.firstSeen >= begin - MAX_FLIGHT_DURATION)
+    if end is not None:
+        conditions.append(Flights.firstSeen < end)
+
+    return tuple(conditions)
+
+def encode_cursor(row, direction):
+    # opaque cursor of the flight following row
+    seen = row[DIRECTIONS[direction][2]]
+    return base64.urlsafe_b64encode(json.dumps([seen.isoformat(), row[0]]).encode()).decode()
+
+def decode_cursor(cursor):
+    """(seen, id) of a cursor returned by encode_cursor, ValueError if it's not valid."""
+    try:
+        seen, flight_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(seen), int(flight_id)
+    except (binascii.Error, TypeError, UnicodeDecodeError) as e:
+        raise ValueError(f"invalid cursor: {e}")
+
+def query(airport_id, direction, begin=None, end=None, after=None):
+    """Statement of the flights of an airport in a direction, seen in [begin, end) and after the (seen, id) key after.
+
+    airport_id None (airport never stored) matches no flight.
+    """
+    airport_column, seen_column, _ = DIRECTIONS[direction]
+
+    stmt = db.select(*COLUMNS).where(airport_column == airport_id)
+
+    if begin is not None:
+        stmt = stmt.where(seen_column >= begin)
+    if end is not None:
+        stmt = stmt.where(seen_column < end)
+
+    stmt = stmt.where(*first_seen_bounds(seen_column, begin, end))
+
+    if after is not None:
+        seen, flight_id = after
+        # (seen, id) > (after): expanded, so it's a range on the (airport, seen) index
+        stmt = stmt.where(db.or_(
+            seen_column > seen,
+            db.and_(seen_column == seen, Flights.id > flight_id)
+        ))
+
+    return stmt.order_by(seen_column, Flights.id)
+
+def rows_to_dicts(rows):
+    # same fields as the OpenSky records, straight from the row tuples: one dictionary lookup per batch
+    aircraft = lookups.aircraft.codes({row[1] for row in rows})
+    airports = lookups.airports.codes({row[3] for row in rows} | {row[5] for row in rows})
+
+    return [{
+        "id": row[0],
+        "icao24": aircraft.get(row[1]),
+        "firstSeen": row[2].isoformat(),
+        "estDepartureAirport": airports.get(row[3]),
+        "lastSeen": row[4].isoformat(),
+        "estArrivalAirport": airports.get(row[5]),
+        "callsign": row[6]
+    } for row in rows]
+
+def flights_to_dicts(flights):
+    # same as rows_to_dicts for Flights objects, None stays None
+    dicts = iter(rows_to_dicts([
+        tuple(getattr(flight, key) for key in KEYS) for flight in flights if flight is not None
+    ]))
+
+    return [next(dicts) if flight is not None else None for flight in flights]
+
+def get_page(stmt, direction, limit):
+    # (flights, cursor of the next page or None if this is the last one)
+    rows = db.session.execute(stmt.limit(limit + 1)).all()
+    next_cursor = encode_cursor(rows[limit - 1], direction) if len(rows) > limit else None
+
+    return rows_to_dicts(rows[:limit]), next_cursor
+
+def stream_ndjson(stmt, limit=None):
+    """Yields the json lines of the flights, a batch of rows of the server-side cursor at a time."""
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    result = db.session.execute(stmt, execution_options={
+        "stream_results": True,
+        "yield_per": GET_FLIGHTS_STREAM_BATCH
+    })
+
+    try:
+        for rows in result.partitions():
+            yield "".join(json.dumps(flight) + "\n" for flight in rows_to_dicts(rows))
+    finally:
+        result.close()
@@ -0,0 +1,131 @@
+from extensions import db
+import logging
+import os
+import hashlib
+from itertools import islice
+from collections import defaultdict
+from models import Flights
+from rollups import refresh_daily_counts, refresh_latest_flights
+import query_cache
+import lookups
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+#number of flights sent to flights_db with a single insert, each batch is committed on its own
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 1000))
+
+#order of the values in a flight row: rows are plain tuples, not dicts, and are sent to the db with executemany.
+#Rows carry the OpenSky codes (icao24, departure airport, arrival airport) until encode_flights turns them in ids
+FLIGHT_COLUMNS = ('aircraft_id', 'firstSeen', 'departure_airport_id', 'lastSeen', 'arrival_airport_id', 'callsign')
+
+_insert_sql = None
+
+# the ingest is a chain of generators: fetch -> clean_flights -> dedup_flights -> track_days -> batched -> encode_flights -> insert_flights,
+# so only one batch of flights at a time is kept in memory
+
+def transform_flight(r, _fromtimestamp=datetime.fromtimestamp):
+    # OpenSky record -> flight row, None if the record has to be discarded
+    departure = r.get('estDepartureAirport')
+    arrival = r.get('estArrivalAirport')
+
+    if not departure or not arrival:
+        return None
+
+    return (r['icao24'], _fromtimestamp(r['firstSeen']), departure, _fromtimestamp(r['lastSeen']), arrival, r['callsign'])
+
+def clean_flights(records, transform=transform_flight):
+    #cleaning and filtering results
+    for row in map(transform, records):
+        if row is not None:
+            yield row
+
+def dedup_flights(rows, stats, airports_icao=None):
+    # the same flight comes back from the departures of an airport and the arrivals of another one:
+    # the row is the flight identity (same columns hashed in flight_key), only its first copy goes on.
+    # A flight can come back twice only if both its airports are fetched by the run (all of them if airports_icao
+    # is None), only those rows are remembered, as a 16 bytes digest, so memory doesn't grow with the whole run
+    airports = None if airports_icao is None else {icao.strip().upper() for icao in airports_icao}
+    seen = set()
+
+    for row in rows:
+        if airports is not None and (row[2].strip().upper() not in airports or row[4].strip().upper() not in airports):
+            yield row
+            continue
+
+        digest = hashlib.md5(repr(row).encode()).digest()
+
+        if digest in seen:
+            stats["duplicates"] += 1
+            continue
+
+        seen.add(digest)
+        yield row
+
+def track_days(rows, departure_days, arrival_days):
+    # collects the days of every airport touched by the run, their daily counts and latest flights are refreshed at the end
+    for row in rows:
+        departure_days[row[2]].add(row[1].date())
+        arrival_days[row[4]].add(row[3].date())
+        yield row
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def encode_flights(batches):
+    # codes -> ids of the lookup tables, one query per dictionary and batch at most (none once the codes are cached)
+    for batch in batches:
+        airport_ids = lookups.airports.ids({row[2] for row in batch} | {row[4] for row in batch})
+        aircraft_ids = lookups.aircraft.ids({row[0] for row in batch})
+
+        yield [
+            (aircraft_ids[row[0]], row[1], airport_ids[row[2]], row[3], airport_ids[row[4]], row[5])
+            for row in batch
+        ]
+
+def get_insert_sql():
+    # built once: INSERT IGNORE with one placeholder per column, pymysql turns the executemany in multi-row inserts
+    global _insert_sql
+
+    if _insert_sql is None:
+        preparer = db.engine.dialect.identifier_preparer
+        columns = ", ".join(preparer.quote(c) for c in FLIGHT_COLUMNS)
+        placeholders = ", ".join(["%s"] * len(FLIGHT_COLUMNS))
+        _insert_sql = f"INSERT IGNORE INTO {preparer.format_table(Flights.__table__)} ({columns}) VALUES ({placeholders})"
+
+    return _insert_sql
+
+def insert_flights(batches):
+    #save info in flights_db, returns the number of flights sent to the db
+    total = 0
+    sql = get_insert_sql()
+
+    for batch in batches:
+        db.session.connection().exec_driver_sql(sql, batch)
+        db.session.commit()
+
+        total += len(batch)
+
+    return total
+
+def ingest(records, batch_size=INGEST_BATCH_SIZE, airports_icao=None):
+    # returns the number of flights sent to the db and of duplicates removed during the run.
+    # airports_icao are the airports fetched by the run, None if not known
+    stats = {"flights": 0, "duplicates": 0}
+    departure_days = defaultdict(set)
+    arrival_days = defaultdict(set)
+
+    rows = track_days(dedup_flights(clean_flights(records), stats, airports_icao), departure_days, arrival_days)
+    stats["flights"] = insert_flights(encode_flights(batched(rows, batch_size)))
+
+    if stats["flights"]:
+        refresh_daily_counts(departure_days, arrival_days)
+        refresh_latest_flights(list(departure_days), list(arrival_days))
+
+        #the cached responses of the airports written by the run are no longer valid
+        query_cache.invalidate_airports(departure_days.keys() | arrival_days.keys())
+
+    return stats
@@ -0,0 +1,128 @@
+from extensions import scheduler
+import logging
+import os
+import time
+import json
+import uuid
+import threading
+import redis
+import tasks
+from lookups import normalize_icao
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+#seconds a finished job stays readable from the status endpoint
+JOB_TTL = int(os.getenv('INGEST_JOB_TTL', 86400))
+
+#max seconds an airport stays locked by a job that never finished (e.g. the process died)
+JOB_LOCK_TTL = int(os.getenv('INGEST_JOB_LOCK_TTL', 3600))
+
+#max number of ingest jobs running at the same time in a process
+INGEST_JOB_WORKERS = int(os.getenv('INGEST_JOB_WORKERS', 2))
+
+jobs_cache = redis.Redis(
+    host=os.getenv('REDIS_HOST', 'data-cache'),
+    port=int(os.getenv('REDIS_PORT', 6379)),
+    db = 2,
+    decode_responses = True
+)
+
+#created on first use, so every worker process has its own threads
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=INGEST_JOB_WORKERS, thread_name_prefix='ingest')
+
+    return _executor
+
+def job_key(job_id):
+    return f"ingest:job:{job_id}"
+
+def airport_lock_key(icao):
+    return f"ingest:airport:{normalize_icao(icao)}"
+
+def enqueue_ingest(airports_icao):
+    """Starts the ingest of the airports in background, returns {icao: job_id}.
+
+    An airport that already has a queued or running job is not fetched again:
+    it's coalesced into that job, whose id is returned for it.
+    """
+    job_id = uuid.uuid4().hex
+    jobs = {}
+    to_fetch = []
+
+    for icao in dict.fromkeys(map(normalize_icao, airports_icao)):
+        if jobs_cache.set(airport_lock_key(icao), job_id, nx=True, ex=JOB_LOCK_TTL):
+            to_fetch.append(icao)
+            jobs[icao] = job_id
+        else:
+            jobs[icao] = jobs_cache.get(airport_lock_key(icao)) or job_id
+
+    if to_fetch:
+        jobs_cache.hset(job_key(job_id), mapping={
+            "id": job_id,
+            "status": "queued",
+            "airports": json.dumps(to_fetch),
+            "windows_total": 0,
+            "windows_done": 0,
+            "created_at": int(time.time())
+        })
+        jobs_cache.expire(job_key(job_id), JOB_TTL)
+
+        #the scheduler runs in one process only, the jobs run in the process that received the request
+        get_executor().submit(run_ingest_job, job_id, to_fetch)
+
+    return jobs
+
+def run_ingest_job(job_id, airports_icao):
+    key = job_key(job_id)
+    jobs_cache.hset(key, mapping={"status": "running", "started_at": int(time.time())})
+
+    def progress(windows_done, windows_total):
+        jobs_cache.hset(key, mapping={"windows_done": windows_done, "windows_total": windows_total})
+
+    try:
+        with scheduler.app.app_context():
+            stats = tasks.fetch_and_update_db(airports_icao, progress=progress)
+
+        if stats is None:
+            jobs_cache.hset(key, mapping={"status": "failed", "error": "Error retrieving token"})
+        else:
+            jobs_cache.hset(key, mapping={
+                "status": "done",
+                "flights": stats["flights"],
+                "duplicates": stats["duplicates"]
+            })
+
+    except Exception as e:
+        logger.error(f"Ingest job {job_id} failed: {e}")
+        jobs_cache.hset(key, mapping={"status": "failed", "error": str(e)})
+
+    finally:
+        jobs_cache.hset(key, "finished_at", int(time.time()))
+        jobs_cache.expire(key, JOB_TTL)
+
+        for icao in airports_icao:
+            # release the airport only if it's still locked by this job
+            if jobs_cache.get(airport_lock_key(icao)) == job_id:
+                jobs_cache.delete(airport_lock_key(icao))
+
+def get_job(job_id):
+    job = jobs_cache.hgetall(job_key(job_id))
+
+    if not job:
+        return None
+
+    job["airports"] = json.loads(job["airports"])
+
+    for field in ("windows_total", "windows_done", "flights", "duplicates", "created_at", "started_at", "finished_at"):
+        if field in job:
+            job[field] = int(job[field])
+
+    return job
@@ -0,0 +1,53 @@
+import re
+import json
+import codecs
+
+#whitespace and commas between the items of an array
+SEPARATORS = re.compile(r'[\s,]*')
+
+_decode = json.JSONDecoder().raw_decode
+
+def iter_json_array(chunks):
+    """Yields the items of a json array of objects given as chunks of text, without holding the whole document.
+
+    ValueError is raised if the document is not an array or ends before its closing bracket.
+    """
+    buffer = ''
+    pos = 0
+    started = False
+
+    for chunk in chunks:
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+        while True:
+            pos = SEPARATORS.match(buffer, pos).end()
+
+            if pos == len(buffer):
+                break
+
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError("expected a json array")
+
+                started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == ']':
+                return
+
+            try:
+                item, pos_end = _decode(buffer, pos)
+            except json.JSONDecodeError:
+                # item cut by the end of the chunk, decoded again with the next one
+                break
+
+            yield item
+            pos = pos_end
+
+    raise ValueError("truncated json array")
+
+def decode_utf8(byte_chunks):
+    # utf-8 text of chunks of bytes, characters split between two chunks included
+    return codecs.iterdecode(byte_chunks, 'utf-8')
@@ -0,0 +1,108 @@
+from extensions import db
+import os
+import threading
+from models import Airports, Aircraft
+
+#max number of codes kept in memory by every process for each dictionary, the cache is emptied when it's full
+DICTIONARY_CACHE_SIZE = int(os.getenv('DICTIONARY_CACHE_SIZE', 200000))
+
+# airports and aircraft are stored as small integer ids of a lookup table. An id never changes once
+# assigned, so every process caches code -> id and id -> code and never invalidates them
+
+class CodeDictionary:
+    """code <-> id of a lookup table, cached in process.
+
+    Codes are normalized (e.g. upper case ICAO codes) before the lookup, the results are keyed by the codes as given.
+    """
+
+    def __init__(self, model, code_column, normalize, maxsize=DICTIONARY_CACHE_SIZE):
+        self.model = model
+        self.code_column = code_column
+        self.normalize = normalize
+        self.maxsize = maxsize
+        self._ids = {}
+        self._codes = {}
+        self._lock = threading.Lock()
+
+    def _cache(self, pairs):
+        with self._lock:
+            if len(self._ids) + len(pairs) > self.maxsize:
+                self._ids.clear()
+                self._codes.clear()
+
+            for code, code_id in pairs:
+                self._ids[code] = code_id
+                self._codes[code_id] = code
+
+    def _select(self, conn, codes):
+        # the collation of the table ignores case, the codes found are normalized like the ones looked up
+        stmt = db.select(self.code_column, self.model.id).where(self.code_column.in_(codes))
+        return [(self.normalize(code), code_id) for code, code_id in conn.execute(stmt)]
+
+    def ids(self, codes, create=True):
+        """{code: id} of the codes. Codes not in the table yet are added if create, left out otherwise."""
+        normalized = {code: self.normalize(code) for code in codes}
+        ids = {}
+        missing = set()
+
+        for code in set(normalized.values()):
+            code_id = self._ids.get(code)
+
+            if code_id is None:
+                missing.add(code)
+            else:
+                ids[code] = code_id
+
+        if missing:
+            # own connection committed right away: an id is cached only once every process can see it
+            with db.engine.begin() as conn:
+                found = self._select(conn, missing)
+                new = missing - {code for code, _ in found}
+
+                if create and new:
+                    # concurrent ingests may add the same codes, the second insert is ignored
+                    conn.execute(
+                        db.insert(self.model).prefix_with('IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite'),
+                        [{self.code_column.key: code} for code in new]
+                    )
+                    found += self._select(conn, new)
+
+            self._cache(found)
+            ids.update(found)
+
+        return {code: ids[n] for code, n in normalized.items() if n in ids}
+
+    def id(self, code):
+        # read path: None if the code was never stored
+        return self.ids([code], create=False).get(code)
+
+    def codes(self, ids):
+        """{id: code} of the ids."""
+        codes = {}
+        missing = set()
+
+        for code_id in set(ids):
+            code = self._codes.get(code_id)
+
+            if code is None:
+                missing.add(code_id)
+            else:
+                codes[code_id] = code
+
+        if missing:
+            with db.engine.connect() as conn:
+                stmt = db.select(self.code_column, self.model.id).where(self.model.id.in_(missing))
+                found = [(self.normalize(code), code_id) for code, code_id in conn.execute(stmt)]
+
+            self._cache(found)
+            codes.update((code_id, code) for code, code_id in found)
+
+        return codes
+
+
+def normalize_icao(code):
+    # airport codes as OpenSky writes them: every module keys airports (caches, locks, counters) by this form
+    return code.strip().upper()
+
+airports = CodeDictionary(Airports, Airports.icao, normalize_icao)
+aircraft = CodeDictionary(Aircraft, Aircraft.icao24, lambda code: code.strip().lower())
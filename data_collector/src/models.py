@@ -1,40 +1,76 @@
 from extensions import db
+from sqlalchemy.dialects import mysql
 
-class Flights(db.Model):
+#ids of the airports: two bytes on flights_db, a plain integer elsewhere so sqlite can generate them
+AIRPORT_ID = db.Integer().with_variant(mysql.SMALLINT(unsigned=True), 'mysql', 'mariadb')
+
+class Airports(db.Model):
+    #dictionary of the ICAO codes of the airports, the other tables store the id
+    id = db.Column(AIRPORT_ID, primary_key=True)
+    icao = db.Column(db.CHAR(4), nullable=False, unique=True)
+
+class Aircraft(db.Model):
+    #dictionary of the icao24 addresses of the aircraft, flights store the id
     id = db.Column(db.Integer, primary_key=True)
-    icao24 = db.Column(db.CHAR(6), nullable=False)
-    firstSeen = db.Column(db.DateTime, nullable=False)
-    estDepartureAirport = db.Column(db.CHAR(4), nullable=False)
+    icao24 = db.Column(db.CHAR(6), nullable=False, unique=True)
+
+class Flights(db.Model):
+    #aircraft and airports are ids of Aircraft and Airports (see lookups), translated back to codes by the read routes.
+    #The table is partitioned by day of firstSeen (see partitions), which is why it's part of every unique key
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    aircraft_id = db.Column(db.Integer, nullable=False)
+    firstSeen = db.Column(db.DateTime, primary_key=True)
+    departure_airport_id = db.Column(AIRPORT_ID, nullable=False)
     lastSeen = db.Column(db.DateTime, nullable=False)
-    estArrivalAirport = db.Column(db.String(4), nullable=False)
+    arrival_airport_id = db.Column(AIRPORT_ID, nullable=False)
     callsign = db.Column(db.CHAR(8), nullable=False)
 
+    #identity of the flight for the INSERT IGNORE of the ingest: 16 bytes computed by the db from the six
+    #columns, unique in place of an index over all of them. Never loaded with the flight
+    flight_key = db.deferred(db.Column(db.BINARY(16), db.Computed(
+        "unhex(md5(concat_ws('|', aircraft_id, firstSeen, departure_airport_id, lastSeen, arrival_airport_id, callsign)))",
+        persisted=True
+    )))
+
     __table_args__ = (
-        db.UniqueConstraint('icao24',
-            'firstSeen',
-            'estDepartureAirport',
-            'lastSeen',
-            'estArrivalAirport',
-            'callsign',
-            name='unique_flight'),
+        db.Index('uq_flights_key', 'flight_key', 'firstSeen', unique=True),
+        #flights of an airport in a time range (rollups, latest flights, /get-flights): with the primary key
+        #stored in every secondary index they are covering for the counts and the (time, id) ordering
+        db.Index('ix_flights_departure', 'departure_airport_id', 'firstSeen'),
+        db.Index('ix_flights_arrival', 'arrival_airport_id', 'lastSeen'),
+        #a new table has only the catch-all partition, the daily ones are added by the maintenance task
+        {'mysql_partition_by': "RANGE COLUMNS(firstSeen) (PARTITION pmax VALUES LESS THAN (MAXVALUE))"},
     )
 
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "icao24": self.icao24,
-            "firstSeen": self.firstSeen.isoformat(),
-            "estDepartureAirport": self.estDepartureAirport,
-            "lastSeen": self.lastSeen.isoformat(),
-            "estArrivalAirport": self.estArrivalAirport,
-            "callsign": self.callsign
-        }
-
 class AirportsOfInterest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(50), nullable=False)
-    icao = db.Column(db.CHAR(4), nullable=False)
+    airport_id = db.Column(AIRPORT_ID, nullable=False)
 
     __table_args__ = (
-        db.UniqueConstraint('email', 'icao', name='unique_email_icao'),
-    )
\ No newline at end of file
+        db.UniqueConstraint('email', 'airport_id', name='unique_email_airport'),
+    )
+
+class FetchWatermarks(db.Model):
+    #end (unix timestamp) of the last OpenSky window fetched for an airport in a direction ('departure'/'arrival')
+    icao = db.Column(db.CHAR(4), primary_key=True)
+    direction = db.Column(db.String(9), primary_key=True)
+    fetched_until = db.Column(db.Integer, nullable=False)
+
+
+class DailyFlightCounts(db.Model):
+    #number of flights of an airport in a day, kept up to date by the ingest and read by /airport-of-interest/average
+    airport_id = db.Column(AIRPORT_ID, primary_key=True, autoincrement=False)
+    day = db.Column(db.Date, primary_key=True)
+    departures = db.Column(db.Integer, nullable=False, default=0)
+    arrivals = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LatestFlights(db.Model):
+    #primary key (id, firstSeen) of the latest departure and arrival of an airport, kept up to date by the ingest
+    #and read by /get-flights/latest: with firstSeen the join reads a single partition of flights
+    airport_id = db.Column(AIRPORT_ID, primary_key=True, autoincrement=False)
+    departure_id = db.Column(db.Integer, nullable=True)
+    departure_first_seen = db.Column(db.DateTime, nullable=True)
+    arrival_id = db.Column(db.Integer, nullable=True)
+    arrival_first_seen = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,290 @@
+import logging
+import os
+import json
+import time
+import threading
+import random
+from datetime import date
+import requests
+import redis
+
+logger = logging.getLogger(__name__)
+
+TOKEN_URL = "https://auth.opensky-network.org/auth/realms/opensky-network/protocol/openid-connect/token"
+
+#seconds before expires_in at which the token is refreshed in background
+TOKEN_REFRESH_MARGIN = int(os.getenv('OPENSKY_TOKEN_REFRESH_MARGIN', 60))
+
+#client side rate limit shared by every process and node: OPENSKY_RATE_PER_SECOND calls per second
+#with bursts of OPENSKY_RATE_BURST, and at most OPENSKY_DAILY_CREDITS credits per day
+OPENSKY_RATE_PER_SECOND = float(os.getenv('OPENSKY_RATE_PER_SECOND', 1))
+OPENSKY_RATE_BURST = int(os.getenv('OPENSKY_RATE_BURST', 5))
+OPENSKY_DAILY_CREDITS = int(os.getenv('OPENSKY_DAILY_CREDITS', 4000))
+OPENSKY_CREDITS_PER_CALL = int(os.getenv('OPENSKY_CREDITS_PER_CALL', 1))
+
+#retries of a call answered with 429/5xx or timed out, with exponential backoff and full jitter
+OPENSKY_MAX_RETRIES = int(os.getenv('OPENSKY_MAX_RETRIES', 3))
+OPENSKY_BACKOFF_BASE = float(os.getenv('OPENSKY_BACKOFF_BASE', 1))
+OPENSKY_BACKOFF_MAX = float(os.getenv('OPENSKY_BACKOFF_MAX', 60))
+
+
+class OpenSkyTokenManager:
+    """Keeps the OpenSky access token in memory until shortly before it expires.
+
+    Only one token request can be in flight at a time: callers that find the
+    token missing or expired wait on the lock, callers that find it about to
+    expire get the current one while a background thread refreshes it.
+    """
+
+    def __init__(self, secrets_path, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.secrets_path = secrets_path
+        self.refresh_margin = refresh_margin
+
+        self._credentials = None
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._refreshing_lock = threading.Lock()
+
+    def _load_credentials(self):
+        # the secrets file is read only once
+        if self._credentials is None:
+            try:
+                with open(self.secrets_path, 'r') as f:
+                    config = json.load(f)
+
+                self._credentials = (config['clientId'], config['clientSecret'])
+
+            except FileNotFoundError:
+                logger.error("Secrets not found!")
+                return None
+
+        return self._credentials
+
+    def _request_token(self):
+        credentials = self._load_credentials()
+
+        if not credentials:
+            return None, 0
+
+        client_id, client_secret = credentials
+
+        payload = {
+            "grant_type": "client_credentials",
+            "client_id": client_id,
+            "client_secret": client_secret
+        }
+
+        try:
+            # data=payload set header at 'Content-Type: application/x-www-form-urlencoded'
+            response = requests.post(TOKEN_URL, data=payload, timeout=10)
+            response.raise_for_status()
+
+            token_data = response.json()
+            expires_in = int(token_data.get("expires_in", 0))
+            return token_data.get("access_token"), time.time() + expires_in
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error retrieving token: {e}")
+            return None, 0
+
+    def _refresh(self):
+        # must be called holding self._lock
+        token, expires_at = self._request_token()
+
+        if token:
+            self._token = token
+            self._expires_at = expires_at
+
+        return token
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                if time.time() >= self._expires_at - self.refresh_margin:
+                    self._refresh()
+        finally:
+            self._refreshing = False
+
+    def get_token(self, force_refresh=False, stale_token=None):
+        """Returns a valid token, or None if it can't be retrieved.
+
+        With force_refresh a new token is requested, unless another caller
+        already replaced stale_token in the meantime.
+        """
+        now = time.time()
+
+        if not force_refresh and self._token and now < self._expires_at - self.refresh_margin:
+            return self._token
+
+        if not force_refresh and self._token and now < self._expires_at:
+            # still valid: refresh it early without blocking the caller
+            with self._refreshing_lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._background_refresh, daemon=True).start()
+
+            return self._token
+
+        with self._lock:
+            if force_refresh and self._token and self._token != stale_token:
+                return self._token
+
+            if not force_refresh and self._token and time.time() < self._expires_at:
+                return self._token
+
+            return self._refresh()
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+            self._expires_at = 0
+
+
+token_manager = OpenSkyTokenManager(os.getenv('SECRETS_PATH', ''))
+
+
+# token bucket in redis: returns 0 if a token was taken, otherwise the seconds to wait.
+# while a pause (429 with Retry-After) is active no token is given
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[3])
+local pause_until = tonumber(redis.call('GET', KEYS[2]) or '0')
+if now < pause_until then
+    return tostring(pause_until - now)
+end
+
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+return tostring(wait)
+"""
+
+
+class OpenSkyRateLimiter:
+    """Rate limit and credit counter of the OpenSky api, kept in redis so every process shares them."""
+
+    BUCKET_KEY = "opensky:bucket"
+    PAUSE_KEY = "opensky:pause_until"
+    REMAINING_KEY = "opensky:credits_remaining"
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._acquire = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    @staticmethod
+    def credits_key(day=None):
+        return f"opensky:credits:{(day or date.today()).isoformat()}"
+
+    def acquire(self):
+        """Waits for a token, returns False if the credits of the day are over or the calls are paused for longer than OPENSKY_BACKOFF_MAX."""
+        if self.credits_used_today() + OPENSKY_CREDITS_PER_CALL > OPENSKY_DAILY_CREDITS:
+            return False
+
+        while True:
+            try:
+                wait = float(self._acquire(
+                    keys=[self.BUCKET_KEY, self.PAUSE_KEY],
+                    args=[OPENSKY_RATE_PER_SECOND, OPENSKY_RATE_BURST, time.time()]
+                ))
+            except redis.RedisError as e:
+                # without redis the calls are not throttled rather than stopped
+                logger.error(f"Rate limiter not available: {e}")
+                return True
+
+            if wait <= 0:
+                return True
+
+            if wait > OPENSKY_BACKOFF_MAX:
+                # a long pause (e.g. the quota of OpenSky is over): the call is given up, the window is fetched next cycle
+                return False
+
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # every caller stops until now + seconds, an earlier pause is never shortened
+        until = time.time() + seconds
+
+        try:
+            current = float(self.redis.get(self.PAUSE_KEY) or 0)
+
+            if until > current:
+                self.redis.set(self.PAUSE_KEY, until, ex=int(seconds) + 1)
+        except redis.RedisError as e:
+            # only this caller waits, the others are not paused
+            logger.error(f"Rate limiter not available: {e}")
+
+    def record_call(self, response):
+        # every answered call but 429 costs credits, the remaining ones told by OpenSky are kept for the planner
+        if response.status_code == 429:
+            return
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.incrby(self.credits_key(), OPENSKY_CREDITS_PER_CALL)
+        pipe.expire(self.credits_key(), 2 * 86400)
+
+        remaining = response.headers.get('X-Rate-Limit-Remaining')
+        if remaining is not None and remaining.isdigit():
+            pipe.set(self.REMAINING_KEY, remaining, ex=86400)
+
+        try:
+            pipe.execute()
+        except redis.RedisError as e:
+            # the call is not counted rather than lost
+            logger.error(f"Rate limiter not available: {e}")
+
+    def credits_used_today(self):
+        try:
+            return int(self.redis.get(self.credits_key()) or 0)
+        except redis.RedisError:
+            return 0
+
+    def calls_left_today(self):
+        left = OPENSKY_DAILY_CREDITS - self.credits_used_today()
+
+        try:
+            remaining = self.redis.get(self.REMAINING_KEY)
+        except redis.RedisError:
+            remaining = None
+
+        if remaining is not None:
+            left = min(left, int(remaining))
+
+        return max(0, left) // OPENSKY_CREDITS_PER_CALL
+
+
+def retry_after(response):
+    # seconds asked by OpenSky before the next call, None if not told
+    for header in ('X-Rate-Limit-Retry-After-Seconds', 'Retry-After'):
+        value = response.headers.get(header)
+
+        if value and value.isdigit():
+            return int(value)
+
+    return None
+
+def backoff(attempt):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(OPENSKY_BACKOFF_MAX, OPENSKY_BACKOFF_BASE * 2 ** attempt))
+
+
+opensky_cache = redis.Redis(
+    host=os.getenv('REDIS_HOST', 'data-cache'),
+    port=int(os.getenv('REDIS_PORT', 6379)),
+    db = 6,
+    decode_responses = True
+)
+
+rate_limiter = OpenSkyRateLimiter(opensky_cache)
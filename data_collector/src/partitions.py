@@ -0,0 +1,149 @@
+from extensions import db, scheduler
+import os
+import gzip
+import logging
+from datetime import date, datetime, timedelta
+from models import Flights
+import history
+import cluster
+
+logger = logging.getLogger(__name__)
+
+# flights is partitioned by day of firstSeen: partition pYYYYMMDD holds the flights of that day (the oldest one
+# also everything before it) and pmax whatever comes after the last day. The maintenance task adds the
+# partitions of the next days and removes the ones older than the retention, exporting them first if asked
+
+#days of flights kept in flights_db, 0 keeps them forever
+FLIGHTS_RETENTION_DAYS = int(os.getenv('FLIGHTS_RETENTION_DAYS', 90))
+
+#what happens to an expired partition: "archive" exports its flights to PARTITION_ARCHIVE_DIR and drops it, "drop" only drops it
+PARTITION_EXPIRY_MODE = os.getenv('PARTITION_EXPIRY_MODE', 'archive')
+PARTITION_ARCHIVE_DIR = os.getenv('PARTITION_ARCHIVE_DIR', '/data/flights-archive')
+
+#partitions created in advance, so the flights of the next days never end up in pmax
+PARTITIONS_AHEAD_DAYS = int(os.getenv('PARTITIONS_AHEAD_DAYS', 3))
+
+PARTITION_MAINTENANCE_INTERVAL = int(os.getenv('PARTITION_MAINTENANCE_INTERVAL', 6 * 3600))
+
+CATCH_ALL_PARTITION = 'pmax'
+
+def partition_name(day):
+    return f"p{day:%Y%m%d}"
+
+def partition_day(name):
+    # day of a daily partition, None for pmax
+    if name == CATCH_ALL_PARTITION:
+        return None
+
+    return datetime.strptime(name[1:], '%Y%m%d').date()
+
+def list_partitions():
+    # names of the partitions of flights in order, empty if the table is not partitioned
+    stmt = db.text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    )
+
+    return db.session.execute(stmt, {"table": Flights.__table__.name}).scalars().all()
+
+def retention_cutoff(today):
+    # partitions of the days before the cutoff are expired
+    return today - timedelta(days=FLIGHTS_RETENTION_DAYS)
+
+def add_partitions(today):
+    days = [day for day in map(partition_day, list_partitions()) if day]
+
+    if days:
+        first = max(days) + timedelta(days=1)
+    elif FLIGHTS_RETENTION_DAYS:
+        # first split of pmax: everything past the retention goes in the day before the cutoff, which expires right away
+        first = retention_cutoff(today) - timedelta(days=1)
+    else:
+        oldest = db.session.execute(db.select(db.func.min(Flights.firstSeen))).scalar()
+        first = oldest.date() if oldest else today
+
+    last = today + timedelta(days=PARTITIONS_AHEAD_DAYS)
+
+    if first > last:
+        return
+
+    new = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    definitions = ", ".join(
+        f"PARTITION {partition_name(day)} VALUES LESS THAN ('{day + timedelta(days=1)}')" for day in new
+    )
+
+    logger.info(f"--- Adding partitions {partition_name(new[0])}..{partition_name(new[-1])} ---")
+
+    # pmax is split: cheap as long as the partitions are added before their days come
+    db.session.execute(db.text(
+        f"ALTER TABLE {Flights.__table__.name} REORGANIZE PARTITION {CATCH_ALL_PARTITION} INTO "
+        f"({definitions}, PARTITION {CATCH_ALL_PARTITION} VALUES LESS THAN (MAXVALUE))"
+    ))
+
+def export_partition(day):
+    # flights up to the end of day (the older partitions are already gone), in the ndjson format of /get-flights,
+    # to a gzip file. Written to a temporary file and renamed, so a file in the archive is always complete.
+    # No order by: the partition is read as it is stored, without sorting it
+    path = os.path.join(PARTITION_ARCHIVE_DIR, f"flights-{day:%Y%m%d}.ndjson.gz")
+    stmt = db.select(*history.COLUMNS).where(Flights.firstSeen < day + timedelta(days=1))
+
+    os.makedirs(PARTITION_ARCHIVE_DIR, exist_ok=True)
+
+    with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+        for lines in history.stream_ndjson(stmt):
+            f.write(lines)
+
+    os.replace(path + '.tmp', path)
+
+    return path
+
+def expire_partitions(today):
+    if not FLIGHTS_RETENTION_DAYS:
+        return
+
+    cutoff = retention_cutoff(today)
+
+    for name in list_partitions():
+        day = partition_day(name)
+
+        if day is None or day >= cutoff:
+            break
+
+        if PARTITION_EXPIRY_MODE == 'archive':
+            try:
+                path = export_partition(day)
+                logger.info(f"--- Partition {name} exported to {path} ---")
+            except OSError as e:
+                # kept until it can be exported
+                logger.error(f"Error exporting partition {name}: {e}")
+                return
+
+        db.session.execute(db.text(f"ALTER TABLE {Flights.__table__.name} DROP PARTITION {name}"))
+        logger.info(f"--- Partition {name} dropped ---")
+
+def maintain_partitions(today=None):
+    today = today or date.today()
+
+    if not list_partitions():
+        logger.info("--- Flights is not partitioned, run migrate-schema. ---")
+        return
+
+    # new partitions first: dropping the last daily partition would leave its days to pmax
+    add_partitions(today)
+    expire_partitions(today)
+
+#also run when the scheduler starts (see run_at_start), a new table has no daily partition yet.
+#A late run is never dropped, however late it is
+@scheduler.task('interval', id='partition_maintenance', seconds=PARTITION_MAINTENANCE_INTERVAL, misfire_grace_time=None, coalesce=True)
+def partition_maintenance():
+    with scheduler.app.app_context():
+        if not cluster.acquire_cycle_lock('partition_maintenance', PARTITION_MAINTENANCE_INTERVAL - 30):
+            return
+
+        maintain_partitions()
+
+def run_at_start():
+    # called once the scheduler is started in the worker holding its lock: next_run_time in the decorator would be
+    # computed at import, in the gunicorn master, and the run could be dropped as missed by the time the worker starts
+    scheduler.modify_job('partition_maintenance', next_run_time=datetime.now())
@@ -0,0 +1,72 @@
+import os
+import json
+import redis
+from lookups import normalize_icao
+from db_routing import REPLICA_STICKY_SECONDS
+from urllib.parse import urlencode
+
+#seconds a response stays in the query cache
+QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', 300))
+
+# responses of the read routes are shared by all the clients: the key is the route plus the parsed
+# query parameters, and contains the version of the airport. The ingest increments the version of the
+# airports it writes, so their old entries are never read again and expire on their own.
+# For REPLICA_STICKY_SECONDS after a new version the responses are read from the primary: a replica
+# lagging behind would store the old flights under the new version
+
+query_cache = redis.Redis(
+    host=os.getenv('REDIS_HOST', 'data-cache'),
+    port=int(os.getenv('REDIS_PORT', 6379)),
+    db = 3,
+    decode_responses = True
+)
+
+def version_key(airport):
+    return f"query:version:{normalize_icao(airport)}"
+
+def primary_key(airport):
+    return f"query:primary:{normalize_icao(airport)}"
+
+def stats_key(route):
+    return f"query:stats:{route}"
+
+def normalize(params):
+    # params are the already parsed query parameters (defaults included), in any order
+    return urlencode(sorted(params.items()))
+
+def lookup(route, airport, params):
+    """Returns (key, cached body or None), key is where the response has to be saved on a miss."""
+    version = query_cache.get(version_key(airport)) or 0
+    key = f"query:{route}:{normalize_icao(airport)}:{version}:{normalize(params)}"
+
+    cached_data = query_cache.get(key)
+    query_cache.hincrby(stats_key(route), "hits" if cached_data else "misses", 1)
+
+    return key, json.loads(cached_data) if cached_data else None
+
+def store(key, body):
+    query_cache.setex(key, QUERY_CACHE_TTL, json.dumps(body))
+
+def invalidate_airports(airports):
+    pipe = query_cache.pipeline(transaction=False)
+
+    for airport in airports:
+        # set before the new version, so whoever reads the new version also finds it
+        pipe.setex(primary_key(airport), REPLICA_STICKY_SECONDS, 1)
+        pipe.incr(version_key(airport))
+
+    pipe.execute()
+
+def needs_primary(airport):
+    # True while the last version of the airport may not have reached the replica yet
+    return bool(query_cache.exists(primary_key(airport)))
+
+def get_stats():
+    stats = {}
+
+    for key in query_cache.scan_iter("query:stats:*"):
+        route = key.split(":", 2)[2]
+        counters = {k: int(v) for k, v in query_cache.hgetall(key).items()}
+        stats[route] = {"hits": counters.get("hits", 0), "misses": counters.get("misses", 0)}
+
+    return stats
@@ -0,0 +1,142 @@
+from extensions import db
+import logging
+from datetime import timedelta
+from models import Flights, DailyFlightCounts, LatestFlights
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+import lookups
+from history import first_seen_bounds
+
+logger = logging.getLogger(__name__)
+
+# the daily counts and the latest flights are recomputed from flights_db for the airports/days touched
+# by the ingest, so flights dropped by INSERT IGNORE are never counted twice. Airports are given by ICAO code
+# and stored by id (see lookups)
+
+def _upsert_counts(airport_column, time_column, count_column, conditions):
+    day = func.date(time_column)
+
+    select = db.select(
+        airport_column,
+        day,
+        func.count(Flights.id)
+    ).where(*conditions).group_by(airport_column, day)
+
+    stmt = mysql_insert(DailyFlightCounts).from_select(['airport_id', 'day', count_column], select)
+    stmt = stmt.on_duplicate_key_update({count_column: stmt.inserted[count_column]})
+    db.session.execute(stmt)
+
+def _refresh(airport_column, time_column, count_column, airport_days):
+    airport_ids = lookups.airports.ids(airport_days)
+
+    for icao, days in airport_days.items():
+        begin = min(days)
+        end = max(days) + timedelta(days=1)
+
+        _upsert_counts(airport_column, time_column, count_column, (
+            airport_column == airport_ids[icao],
+            time_column >= begin,
+            time_column < end,
+            *first_seen_bounds(time_column, begin, end)
+        ))
+
+def refresh_daily_counts(departure_days, arrival_days):
+    # departure_days/arrival_days: {icao: set of days} touched by the ingest
+    _refresh(Flights.departure_airport_id, Flights.firstSeen, 'departures', departure_days)
+    _refresh(Flights.arrival_airport_id, Flights.lastSeen, 'arrivals', arrival_days)
+    db.session.commit()
+
+def rebuild_daily_counts():
+    # recomputes the whole table from flights_db, used for the data saved before the rollup existed.
+    # The counts of the days already past the retention of flights (see partitions) are lost
+    logger.info("--- Rebuilding daily flight counts... ---")
+
+    db.session.execute(db.delete(DailyFlightCounts))
+    _upsert_counts(Flights.departure_airport_id, Flights.firstSeen, 'departures', ())
+    _upsert_counts(Flights.arrival_airport_id, Flights.lastSeen, 'arrivals', ())
+    db.session.commit()
+
+    logger.info("--- Daily flight counts rebuilt. ---")
+
+def _latest_ids(airport_column, time_column, airports):
+    # {airport id: (id, firstSeen) of its flight with the greatest time_column}, ties are broken by the greatest id
+    latest = db.select(
+        airport_column.label('airport_id'),
+        func.max(time_column).label('latest')
+    ).group_by(airport_column)
+
+    if airports is not None:
+        latest = latest.where(airport_column.in_(list(lookups.airports.ids(airports).values())))
+
+    latest = latest.subquery()
+
+    stmt = db.select(
+        latest.c.airport_id,
+        Flights.id,
+        Flights.firstSeen
+    ).join(
+        Flights, (airport_column == latest.c.airport_id) & (time_column == latest.c.latest)
+    )
+
+    latest_ids = {}
+
+    # only the flights tied at the latest time of every airport
+    for airport_id, flight_id, first_seen in db.session.execute(stmt):
+        if airport_id not in latest_ids or flight_id > latest_ids[airport_id][0]:
+            latest_ids[airport_id] = (flight_id, first_seen)
+
+    return latest_ids
+
+def _upsert_latest(direction, latest_ids):
+    if not latest_ids:
+        return
+
+    id_column = f"{direction}_id"
+    first_seen_column = f"{direction}_first_seen"
+
+    stmt = mysql_insert(LatestFlights).values([
+        {"airport_id": airport_id, id_column: flight_id, first_seen_column: first_seen}
+        for airport_id, (flight_id, first_seen) in latest_ids.items()
+    ])
+    stmt = stmt.on_duplicate_key_update({
+        id_column: stmt.inserted[id_column],
+        first_seen_column: stmt.inserted[first_seen_column]
+    })
+    db.session.execute(stmt)
+
+def refresh_latest_flights(departure_airports, arrival_airports):
+    # airports=None recomputes every airport in flights_db
+    _upsert_latest('departure', _latest_ids(Flights.departure_airport_id, Flights.firstSeen, departure_airports))
+    _upsert_latest('arrival', _latest_ids(Flights.arrival_airport_id, Flights.lastSeen, arrival_airports))
+    db.session.commit()
+
+def rebuild_latest_flights():
+    logger.info("--- Rebuilding latest flights... ---")
+
+    db.session.execute(db.delete(LatestFlights))
+    refresh_latest_flights(None, None)
+
+    logger.info("--- Latest flights rebuilt. ---")
+
+def latest_flights_stmt(airport_id):
+    #single lookup on the latest flights table, the flights are joined by their whole primary key (id, firstSeen),
+    #so only the partition of each flight is read
+    departure = aliased(Flights)
+    arrival = aliased(Flights)
+
+    return db.select(departure, arrival)\
+    .select_from(LatestFlights)\
+    .outerjoin(departure, (departure.id == LatestFlights.departure_id) & (departure.firstSeen == LatestFlights.departure_first_seen))\
+    .outerjoin(arrival, (arrival.id == LatestFlights.arrival_id) & (arrival.firstSeen == LatestFlights.arrival_first_seen))\
+    .where(LatestFlights.airport_id == airport_id)
+
+def daily_counts_stmt(airport_id, since):
+    #departures and arrivals of the airport from the day since on: at most one row per day, whatever the size of Flights
+    return db.select(
+        func.coalesce(func.sum(DailyFlightCounts.departures), 0),
+        func.coalesce(func.sum(DailyFlightCounts.arrivals), 0)
+    ).where(
+        DailyFlightCounts.airport_id == airport_id,
+        DailyFlightCounts.day >= since
+    )
@@ -0,0 +1,189 @@
+from extensions import db
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import inspect
+from models import Flights, AirportsOfInterest, DailyFlightCounts, LatestFlights
+import history
+import rollups
+import partitions
+
+logger = logging.getLogger(__name__)
+
+# db.create_all() only creates missing tables: tables created when airports and aircraft were stored
+# as codes, before the lookup tables and the airport/time indexes of flights, are rebuilt by migrate_schema,
+# and check_query_plans verifies that no read route is left without an index
+
+#EXPLAIN access types reading a whole table or a whole index
+FULL_SCAN_TYPES = ('ALL', 'index')
+
+#columns of codes of the legacy tables, added to the lookup tables before the copy
+LEGACY_CODES = {
+    'airports (icao)': (
+        ('flights_legacy', 'estDepartureAirport'),
+        ('flights_legacy', 'estArrivalAirport'),
+        ('airports_of_interest_legacy', 'icao'),
+        ('daily_flight_counts_legacy', 'icao'),
+        ('latest_flights_legacy', 'icao'),
+    ),
+    'aircraft (icao24)': (
+        ('flights_legacy', 'icao24'),
+    ),
+}
+
+#legacy tables (recognized by a column of codes) and the copy of their rows into the new table, ids are kept.
+#INSERT IGNORE everywhere: a copy interrupted after its commit can be run again
+LEGACY_TABLES = {
+    Flights: ('icao24', """
+        INSERT IGNORE INTO flights (id, aircraft_id, firstSeen, departure_airport_id, lastSeen, arrival_airport_id, callsign)
+        SELECT l.id, ac.id, l.firstSeen, d.id, l.lastSeen, a.id, l.callsign FROM flights_legacy l
+        JOIN aircraft ac ON ac.icao24 = l.icao24
+        JOIN airports d ON d.icao = l.estDepartureAirport
+        JOIN airports a ON a.icao = l.estArrivalAirport
+    """),
+    AirportsOfInterest: ('icao', """
+        INSERT IGNORE INTO airports_of_interest (id, email, airport_id)
+        SELECT l.id, l.email, a.id FROM airports_of_interest_legacy l JOIN airports a ON a.icao = l.icao
+    """),
+    DailyFlightCounts: ('icao', """
+        INSERT IGNORE INTO daily_flight_counts (airport_id, day, departures, arrivals)
+        SELECT a.id, l.day, l.departures, l.arrivals FROM daily_flight_counts_legacy l JOIN airports a ON a.icao = l.icao
+    """),
+    LatestFlights: ('icao', """
+        INSERT IGNORE INTO latest_flights (airport_id, departure_id, departure_first_seen, arrival_id, arrival_first_seen)
+        SELECT a.id, l.departure_id, d.firstSeen, l.arrival_id, r.firstSeen FROM latest_flights_legacy l
+        JOIN airports a ON a.icao = l.icao
+        LEFT JOIN flights d ON d.id = l.departure_id
+        LEFT JOIN flights r ON r.id = l.arrival_id
+    """),
+}
+
+def migrate_schema():
+    # every legacy table is renamed to <name>_legacy, created again from the model and filled with a single
+    # INSERT ... SELECT (so flights is rewritten once), then the legacy table is dropped.
+    # MariaDB commits every DDL statement on its own: a migration stopped halfway leaves <name>_legacy
+    # tables behind, and running it again resumes from them
+    inspector = inspect(db.engine)
+    existing = set(inspector.get_table_names())
+
+    to_rename = [
+        model for model, (code_column, _) in LEGACY_TABLES.items()
+        if model.__table__.name in existing
+        and code_column in {c['name'] for c in inspector.get_columns(model.__table__.name)}
+    ]
+    legacy = [
+        model for model in LEGACY_TABLES
+        if model in to_rename or f"{model.__table__.name}_legacy" in existing
+    ]
+
+    if not legacy:
+        add_latest_first_seen()
+        partition_flights()
+        return
+
+    with db.engine.begin() as conn:
+        for model in to_rename:
+            logger.info(f"--- Renaming {model.__table__.name} to {model.__table__.name}_legacy ---")
+            conn.exec_driver_sql(f"RENAME TABLE {model.__table__.name} TO {model.__table__.name}_legacy")
+
+        for model in legacy:
+            # already there if a previous run was stopped after creating it
+            model.__table__.create(conn, checkfirst=True)
+
+        tables = {f"{model.__table__.name}_legacy" for model in legacy}
+
+        for lookup_table, columns in LEGACY_CODES.items():
+            selects = [f"SELECT {column} FROM {table}" for table, column in columns if table in tables]
+
+            if selects:
+                logger.info(f"--- Filling {lookup_table} ---")
+                conn.exec_driver_sql(f"INSERT IGNORE INTO {lookup_table} " + " UNION ".join(selects))
+
+        for model in legacy:
+            logger.info(f"--- Copying {model.__table__.name} ---")
+            conn.exec_driver_sql(LEGACY_TABLES[model][1])
+            conn.exec_driver_sql(f"DROP TABLE {model.__table__.name}_legacy")
+
+    add_latest_first_seen()
+    logger.info("--- Schema migrated. ---")
+
+def add_latest_first_seen():
+    # latest_flights created before it kept firstSeen: the columns are added and filled from flights,
+    # joined by id only this once
+    table = LatestFlights.__table__.name
+
+    if 'departure_first_seen' in {c['name'] for c in inspect(db.engine).get_columns(table)}:
+        return
+
+    with db.engine.begin() as conn:
+        logger.info(f"--- Adding firstSeen to {table} ---")
+        conn.exec_driver_sql(
+            f"ALTER TABLE {table} ADD COLUMN departure_first_seen DATETIME NULL AFTER departure_id, "
+            f"ADD COLUMN arrival_first_seen DATETIME NULL AFTER arrival_id"
+        )
+        conn.exec_driver_sql(
+            f"UPDATE {table} l LEFT JOIN flights d ON d.id = l.departure_id LEFT JOIN flights r ON r.id = l.arrival_id "
+            f"SET l.departure_first_seen = d.firstSeen, l.arrival_first_seen = r.firstSeen"
+        )
+
+def partition_flights():
+    # flights created before partitioning: firstSeen joins the primary key and the unique key, as partitioning
+    # requires, then the table gets pmax only and the maintenance task splits it by day
+    if partitions.list_partitions():
+        logger.info("--- Schema already up to date. ---")
+        return
+
+    table = Flights.__table__.name
+
+    with db.engine.begin() as conn:
+        logger.info(f"--- Adding firstSeen to the keys of {table} ---")
+        conn.exec_driver_sql(
+            f"ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY (id, firstSeen), "
+            f"DROP INDEX uq_flights_key, ADD UNIQUE INDEX uq_flights_key (flight_key, firstSeen)"
+        )
+
+        logger.info(f"--- Partitioning {table} ---")
+        conn.exec_driver_sql(f"ALTER TABLE {table} PARTITION BY {Flights.__table__.dialect_options['mysql']['partition_by']}")
+
+    logger.info("--- Flights partitioned. ---")
+
+def read_route_queries(airport_id=1):
+    # {route: statement} for every query of the read routes, with sample parameters
+    now = datetime.now()
+    day_ago = now - timedelta(days=1)
+    page = history.GET_FLIGHTS_DEFAULT_LIMIT + 1
+
+    queries = {
+        "/get-flights/latest": rollups.latest_flights_stmt(airport_id),
+        "/airport-of-interest/average": rollups.daily_counts_stmt(airport_id, day_ago.date()),
+    }
+
+    for direction in history.DIRECTIONS:
+        queries[f"/get-flights {direction}"] = history.query(airport_id, direction).limit(page)
+        queries[f"/get-flights {direction}, range and cursor"] = \
+            history.query(airport_id, direction, day_ago, now, (day_ago, 0)).limit(page)
+
+    return queries
+
+def explain(stmt):
+    # pymysql uses named parameters (pyformat): the statement is sent with the dictionary of its parameters
+    compiled = stmt.compile(dialect=db.engine.dialect)
+    result = db.session.connection().exec_driver_sql("EXPLAIN " + str(compiled), compiled.params)
+
+    return [dict(row._mapping) for row in result]
+
+def check_query_plans():
+    """Logs the plan of every read route query and returns the routes scanning a whole table or index."""
+    failed = []
+
+    for route, stmt in read_route_queries().items():
+        for step in explain(stmt):
+            logger.info(f"{route}: table={step['table']} type={step['type']} key={step['key']} rows={step['rows']}")
+
+            if step['type'] in FULL_SCAN_TYPES:
+                logger.error(f"--- {route} reads the whole {step['table']} table ---")
+                failed.append(route)
+
+    if not failed:
+        logger.info("--- Every read route uses an index. ---")
+
+    return failed
@@ -3,63 +3,123 @@ import logging
 import requests
 import os
 import time
-import json
-from models import AirportsOfInterest, Flights
-from sqlalchemy import insert
-from datetime import datetime
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, chain
+from requests.adapters import HTTPAdapter
+from models import FetchWatermarks
+from opensky import token_manager, rate_limiter, retry_after, backoff, OPENSKY_MAX_RETRIES, OPENSKY_BACKOFF_MAX
+from ingest import ingest
+import cluster
+import archive
+from json_stream import iter_json_array, decode_utf8
+import demand
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+#max number of concurrent calls to the OpenSky api
+OPENSKY_MAX_WORKERS = int(os.getenv('OPENSKY_MAX_WORKERS', 8))
+
+#largest interval (seconds) accepted by the OpenSky departure/arrival endpoints for a single call
+OPENSKY_MAX_WINDOW = int(os.getenv('OPENSKY_MAX_WINDOW', 2 * 86400))
+
+#interval fetched for an airport without watermark, and how far back a stale watermark is allowed to go
+INGEST_DEFAULT_LOOKBACK = int(os.getenv('INGEST_DEFAULT_LOOKBACK', 86400))
+INGEST_MAX_LOOKBACK = int(os.getenv('INGEST_MAX_LOOKBACK', 7 * 86400))
+
+#OpenSky publishes the flights of a day with a nightly batch: only the days before the one of now - OPENSKY_SETTLE_DELAY
+#are requested, a window ending later would come back empty and its flights would never be fetched again
+OPENSKY_SETTLE_DELAY = int(os.getenv('OPENSKY_SETTLE_DELAY', 6 * 3600))
+
+DIRECTIONS = ('departure', 'arrival')
+
+#bytes of an OpenSky response downloaded at a time, and max number of flights decoded but not yet ingested
+OPENSKY_CHUNK_SIZE = 64 * 1024
+FETCH_QUEUE_SIZE = int(os.getenv('FETCH_QUEUE_SIZE', 10000))
+
+#"leader": only the node taking the lock of the cycle refreshes the airports,
+#"sharded": every node refreshes the airports assigned to it by consistent hashing over the live nodes
+UPDATE_DB_MODE = os.getenv('UPDATE_DB_MODE', 'leader')
+
+#every tick the airports whose refresh interval has elapsed are refreshed (see demand). The settled limit moves
+#once a day: the tick only spreads the refreshes of the day over the budget and retries the failed windows
+UPDATE_DB_TICK = int(os.getenv('UPDATE_DB_TICK', 3600))
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    # one pooled session shared by all the workers, so connections to OpenSky are reused
+    global _http_session
+
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=OPENSKY_MAX_WORKERS)
+            session.mount('https://', adapter)
+            _http_session = session
+
+    return _http_session
+
 def get_opensky_token():
-    url = "https://auth.opensky-network.org/auth/realms/opensky-network/protocol/openid-connect/token"
-    
-    secrets_path = os.getenv('SECRETS_PATH', '')
+    # the token is cached by the token manager until shortly before it expires
+    return token_manager.get_token()
 
-    try:
-        with open(secrets_path, 'r') as f:
-            config = json.load(f)
-        
-        client_id = config['clientId']
-        client_secret = config['clientSecret']
+class FlightStream:
+    # flights of an OpenSky response, decoded one by one while the body is downloaded and archived.
+    # It can be iterated once; close() releases the response if it's not going to be read.
+    # Iterating raises requests.exceptions.RequestException or ValueError if the body can't be read to the end
+    def __init__(self, response, archived):
+        self.response = response
+        self.archived = archived
 
-    except FileNotFoundError:
-        logger.error("Secrets not found!")
-        return None
+    def chunks(self):
+        for chunk in self.response.iter_content(chunk_size=OPENSKY_CHUNK_SIZE):
+            self.archived.write(chunk)
+            yield chunk
 
-    payload = {
-        "grant_type": "client_credentials",
-        "client_id": client_id,
-        "client_secret": client_secret
-    }
+    def __iter__(self):
+        with self.response, self.archived:
+            chunks = self.chunks()
+            yield from iter_json_array(decode_utf8(chunks))
 
-    try: 
-        # data=payload set header at 'Content-Type: application/x-www-form-urlencoded'
-        response = requests.post(url, data=payload, timeout=10)
-        response.raise_for_status()
+            # whatever follows the array, so the archived body is complete
+            for _ in chunks:
+                pass
 
-        token_data = response.json()
-        access_token = token_data.get("access_token")
-        return access_token
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error retrieving token: {e}")
-        return None
+    def close(self):
+        self.response.close()
 
-def get_flights_by_airport(icao, begin, end, token, departure=None, arrival=None):
+def get_flights_by_airport(icao, begin, end, departure=None, arrival=None, retry_unauthorized=True):
+    # returns an iterable over the flights, or None if the call failed and the window has to be requested again.
+    # The body is streamed: an error can still come up while iterating, and the window is then incomplete.
+    # The token is read from the token manager at every attempt, so a long ingest gets its early refreshes
     departures_url = "https://opensky-network.org/api/flights/departure"
     arrivals_url = "https://opensky-network.org/api/flights/arrival"
 
     if departure and not arrival:
         url = departures_url
+        direction = 'departure'
     elif not departure and arrival:
         url = arrivals_url
+        direction = 'arrival'
     else:
-        deps = get_flights_by_airport(icao, begin, end, token, departure=True)
-        arrs = get_flights_by_airport(icao, begin, end, token, arrival=True)
-        return deps + arrs
+        deps = get_flights_by_airport(icao, begin, end, departure=True)
+
+        if deps is None:
+            return None
 
-    headers = {}
-    headers['Authorization'] = f"Bearer {token}"
+        arrs = get_flights_by_airport(icao, begin, end, arrival=True)
+
+        if arrs is None:
+            if isinstance(deps, FlightStream):
+                deps.close()
+            return None
+
+        return chain(deps, arrs)
 
     payload = {
         "airport": icao,
@@ -67,72 +127,311 @@ def get_flights_by_airport(icao, begin, end, token, departure=None, arrival=None
         "end": end
     }
 
-    try:
-        response = requests.get(url, params=payload, headers=headers, timeout=15)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 404:
+    attempt = 0
+
+    while True:
+        #throttling shared with every process, no call once the credits of the day are over
+        if not rate_limiter.acquire():
+            print(f"OpenSky daily credits exhausted or calls paused, skipping: {icao}")
+            return None
+
+        token = get_opensky_token()
+
+        if not token:
+            print(f"Error retrieving token, skipping: {icao}")
+            return None
+
+        headers = {}
+        headers['Authorization'] = f"Bearer {token}"
+
+        try:
+            response = get_http_session().get(url, params=payload, headers=headers, timeout=15, stream=True)
+        except requests.exceptions.RequestException as e:
+            if attempt >= OPENSKY_MAX_RETRIES:
+                print(f"Error during api call for {icao}: {e}")
+                return None
+
+            time.sleep(backoff(attempt))
+            attempt += 1
+            continue
+
+        rate_limiter.record_call(response)
+
+        if response.status_code != 200:
+            # the body of an error is not needed, the connection goes back to the pool
+            response.close()
+
+        if response.status_code == 429 or response.status_code >= 500:
+            wait = retry_after(response)
+
+            if wait is not None and wait > OPENSKY_BACKOFF_MAX:
+                # e.g. the quota of OpenSky is over: nobody waits hours, the window is fetched again next cycle
+                if response.status_code == 429:
+                    rate_limiter.pause(wait)
+
+                print(f"Error during api call for {icao}: status {response.status_code}, retry after {wait}s")
+                return None
+
+            if attempt >= OPENSKY_MAX_RETRIES:
+                print(f"Error during api call for {icao}: status {response.status_code}")
+                return None
+
+            if response.status_code == 429:
+                # everyone stops, not only this call
+                rate_limiter.pause(wait if wait is not None else backoff(attempt))
+
+            time.sleep(wait if wait is not None else backoff(attempt))
+            attempt += 1
+            continue
+
+        if response.status_code == 401 and retry_unauthorized:
+            # token revoked or expired before its expires_in: force a refresh and retry once
+            retry_unauthorized = False
+            if token_manager.get_token(force_refresh=True, stale_token=token):
+                continue
+
+            return None
+
+        if response.status_code == 404:
             print(f"Airport not supported or no data available for: {icao}")
+            archive.save(icao, direction, begin, end, b"[]")
             return []
-    except requests.exceptions.ReadTimeout:
-        print(f"Timeout expired for: {icao}")
-        return []
-    except requests.exceptions.RequestException as e:
-        print(f"Error during api call: {e}")
-        return []
-
-def fetch_and_update_db(airports_icao):
-    #retrieving token
-    token = get_opensky_token()
-
-    if not token:
-        logger.error("Error retrieving token!")
-        return
-        
-    #retrieving info on flights for specified airports
-    result = []
 
-    for icao in airports_icao:
-        end = int(time.time())
-        begin = end - 86400
-        result += get_flights_by_airport(icao, begin, end, token, departure=True, arrival=True)
+        try:
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"Error during api call: {e}")
+            return None
 
-    if not result:
-        logger.info("--- No results found. ---")
+        return FlightStream(response, archive.ArchiveWriter(icao, direction, begin, end))
+
+def split_windows(begin, end, size):
+    while begin < end:
+        yield begin, min(begin + size, end)
+        begin += size
+
+def load_watermarks(airports_icao):
+    stmt = db.select(FetchWatermarks).where(FetchWatermarks.icao.in_(airports_icao))
+    watermarks = db.session.execute(stmt).scalars().all()
+
+    return {(w.icao, w.direction): w.fetched_until for w in watermarks}
+
+def save_watermarks(watermarks):
+    if not watermarks:
         return
 
-    #cleaning and filtering results
-    clean_result = []
-
-    for r in result:
-        if r.get('estDepartureAirport') and r.get('estArrivalAirport'):
-            flight = {k: v for k, v in r.items() if k in Flights.__table__.columns.keys()}
-                
-            flight['firstSeen'] = datetime.fromtimestamp(flight['firstSeen']) 
-            flight['lastSeen'] = datetime.fromtimestamp(flight['lastSeen'])
-                    
-            clean_result.append(flight)
-
-    #save info in flights_db
-    stmt = insert(Flights).values(clean_result)
-    stmt = stmt.prefix_with('IGNORE')
+    rows = [
+        {"icao": icao, "direction": direction, "fetched_until": fetched_until}
+        for (icao, direction), fetched_until in watermarks.items()
+    ]
+
+    #a watermark never goes back, even if another run moved it forward in the meantime
+    stmt = mysql_insert(FetchWatermarks).values(rows)
+    stmt = stmt.on_duplicate_key_update(
+        fetched_until=db.func.greatest(FetchWatermarks.fetched_until, stmt.inserted.fetched_until)
+    )
     db.session.execute(stmt)
     db.session.commit()
 
-@scheduler.task('interval', id='update_db', hours=24)
+def settled_until(now):
+    # start (UTC) of the day of now - OPENSKY_SETTLE_DELAY: the flights before it are published,
+    # no window ends and no watermark goes past it
+    settled = now - OPENSKY_SETTLE_DELAY
+    return settled - settled % 86400
+
+def plan_windows(airports_icao, now):
+    # only the gap since the watermark is requested, up to the settled limit, split in windows OpenSky accepts
+    watermarks = load_watermarks(airports_icao)
+    limit = settled_until(now)
+    windows = []
+
+    for icao in airports_icao:
+        for direction in DIRECTIONS:
+            begin = watermarks.get((icao, direction), limit - INGEST_DEFAULT_LOOKBACK)
+            begin = max(begin, limit - INGEST_MAX_LOOKBACK)
+
+            for window_begin, window_end in split_windows(begin, limit, OPENSKY_MAX_WINDOW):
+                windows.append((icao, direction, window_begin, window_end))
+
+    return windows
+
+def advance_watermarks(windows, fetched):
+    # a watermark moves up to the end of the last window fetched without gaps before it
+    watermarks = {}
+    failed = set()
+
+    for icao, direction, begin, end in sorted(windows):
+        key = (icao, direction)
+
+        if key in failed:
+            continue
+
+        if (icao, direction, begin, end) in fetched:
+            watermarks[key] = end
+        else:
+            failed.add(key)
+
+    return watermarks
+
+def fetch_windows(windows, fetched, progress=None):
+    # yields the flights of the windows while they are downloaded. At most OPENSKY_MAX_WORKERS * 2 calls
+    # are submitted at a time and the workers hand the flights over through a queue of FETCH_QUEUE_SIZE,
+    # so they wait for the db instead of piling responses up in memory.
+    # the windows fetched entirely are added to fetched, progress(done, total) is called after every call
+    total = len(windows)
+    completed = 0
+    in_flight = 0
+    windows = iter(windows)
+
+    # flights (dicts) and, at the end of every window, a (window, fetched entirely) tuple
+    results = queue.Queue(maxsize=FETCH_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def put(item):
+        # False if the consumer is gone
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def fetch(window):
+        icao, direction, begin, end = window
+        ok = False
+
+        try:
+            flights = get_flights_by_airport(icao, begin, end, **{direction: True})
+
+            if flights is None:
+                return
+
+            for flight in flights:
+                if not put(flight):
+                    return
+
+            ok = True
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error reading the response for {icao}: {e}")
+        finally:
+            put((window, ok))
+
+    with ThreadPoolExecutor(max_workers=OPENSKY_MAX_WORKERS) as executor:
+        def submit(n):
+            nonlocal in_flight
+
+            for window in islice(windows, n):
+                executor.submit(fetch, window)
+                in_flight += 1
+
+        try:
+            submit(OPENSKY_MAX_WORKERS * 2)
+
+            while in_flight:
+                item = results.get()
+
+                if not isinstance(item, tuple):
+                    yield item
+                    continue
+
+                window, ok = item
+                in_flight -= 1
+                submit(1)
+
+                completed += 1
+                if progress:
+                    progress(completed, total)
+
+                if ok:
+                    fetched.add(window)
+        finally:
+            # the ingest stopped early: the workers drop what they are reading
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def fetch_and_update_db(airports_icao, progress=None, replay=False, replay_begin=None, replay_end=None):
+    # returns the ingest stats, None if the token can't be retrieved.
+    # with replay the flights are read from the archive of the OpenSky responses, no api call is made
+    # and the watermarks are left as they are
+    if replay:
+        airports_icao = list(dict.fromkeys(airports_icao))
+        stats = ingest(archive.replay(airports_icao, DIRECTIONS, replay_begin, replay_end), airports_icao=airports_icao)
+        logger.info(f"--- Replay: {stats['flights']} flights saved, {stats['duplicates']} duplicates removed. ---")
+        return stats
+
+    #the token is checked before planning anything, the calls read it again from the token manager
+    if not get_opensky_token():
+        logger.error("Error retrieving token!")
+        return
+
+    airports_icao = list(dict.fromkeys(airports_icao))
+    windows = plan_windows(airports_icao, int(time.time()))
+
+    if not windows:
+        logger.info("--- Airports already up to date. ---")
+        return {"flights": 0, "duplicates": 0}
+
+    #retrieving info on flights for specified airports and saving them in flights_db, one batch at a time
+    fetched = set()
+    stats = ingest(fetch_windows(windows, fetched, progress), airports_icao=airports_icao)
+
+    if not stats["flights"]:
+        logger.info("--- No results found. ---")
+
+    logger.info(f"--- {stats['flights']} flights saved, {stats['duplicates']} duplicates removed. ---")
+
+    #the watermarks are saved only once the flights are committed
+    save_watermarks(advance_watermarks(windows, fetched))
+
+    return stats
+
+def last_refresh(airports_icao):
+    # an airport was refreshed up to the oldest watermark of its two directions
+    watermarks = load_watermarks(airports_icao)
+
+    return {
+        icao: min(watermarks.get((icao, direction), 0) for direction in DIRECTIONS)
+        for icao in airports_icao
+    }
+
+@scheduler.task('interval', id='update_db', seconds=UPDATE_DB_TICK)
 def update_database():
     with scheduler.app.app_context():
-        logger.info("--- Updating database... ---")
-        
-        #read airports from flights_db
-        stmt = db.select(AirportsOfInterest.icao)
-        result = db.session.execute(stmt)
-        airports_icao = result.scalars().all()
+        #the lock lasts a bit less than the tick, so the next one is free again
+        if UPDATE_DB_MODE != 'sharded' and not cluster.acquire_cycle_lock('update_db', UPDATE_DB_TICK - 30):
+            logger.info("--- Update already done by another node in this cycle. ---")
+            return
 
-        if not airports_icao:
+        #read airports and their number of subscribers from flights_db
+        subscribers = demand.subscriber_counts()
+
+        if not subscribers:
             logger.info("--- No airports found in DB. ---")
             return
+
+        #the plan is made on every airport, so it fits the budget of the whole cluster
+        scores = demand.demand_scores(subscribers)
+        intervals = demand.refresh_intervals(scores)
+        nodes = [cluster.NODE_ID]
+
+        if UPDATE_DB_MODE == 'sharded':
+            nodes = cluster.live_nodes()
+            owned = set(cluster.owned_airports(list(subscribers), nodes))
+            scores = {icao: score for icao, score in scores.items() if icao in owned}
+            intervals = {icao: interval for icao, interval in intervals.items() if icao in owned}
+            logger.info(f"--- {len(scores)} airports assigned to {cluster.NODE_ID} ({len(nodes)} live nodes). ---")
+
+        #the watermarks stop at the settled limit, the intervals are measured up to it
+        airports_icao = demand.due_airports(
+            scores, intervals, last_refresh(list(scores)), settled_until(int(time.time())), UPDATE_DB_TICK, len(nodes)
+        )
+
+        if not airports_icao:
+            return
+
+        logger.info(f"--- Updating {len(airports_icao)} airports... ---")
         
         fetch_and_update_db(airports_icao)
 
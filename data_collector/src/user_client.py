@@ -0,0 +1,73 @@
+import os
+import sys
+import threading
+import grpc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "grpc_generated"))
+import user_service_pb2, user_service_pb2_grpc
+
+#max number of emails sent with a single CheckUsersExist
+USERS_CHECK_BATCH_SIZE = int(os.getenv('USERS_CHECK_BATCH_SIZE', 500))
+
+#setup grpc channel
+#the stream is meant for long-lived callers, so it has no deadline
+service_config = """{
+    "methodConfig": [{
+        "name": [{"service": "CheckUserService"}],
+        "retryPolicy": {
+            "maxAttempts": 3,
+            "initialBackoff": "0.5s",
+            "maxBackoff": "3s",
+            "backoffMultiplier": 2,
+            "retryableStatusCodes": ["UNAVAILABLE"]
+        },
+        "timeout": "5s"
+    }, {
+        "name": [{"service": "CheckUserService", "method": "CheckUsersExistStream"}]
+    }]
+}"""
+
+options = [('grpc.service_config', service_config)]
+
+#grpc channels can't cross a fork: every process creates its own on first use
+_channel_pid = None
+_stub = None
+_stub_lock = threading.Lock()
+
+def get_stub():
+    global _channel_pid, _stub
+
+    with _stub_lock:
+        if _stub is None or _channel_pid != os.getpid():
+            channel = grpc.insecure_channel('user-manager:50051', options=options)
+            _stub = user_service_pb2_grpc.CheckUserServiceStub(channel)
+            _channel_pid = os.getpid()
+
+    return _stub
+
+
+def check_users_exist(emails, batch_size=USERS_CHECK_BATCH_SIZE):
+    """Returns {email: True if registered}, with one CheckUsersExist every batch_size emails.
+
+    grpc.RpcError is raised if user-manager can't be reached.
+    """
+    emails = list(dict.fromkeys(emails))
+    result = {}
+
+    for i in range(0, len(emails), batch_size):
+        response = get_stub().CheckUsersExist(
+            user_service_pb2.UsersCheckRequest(emails = emails[i:i + batch_size]),
+            timeout=5
+        )
+
+        for r in response.results:
+            result[r.email] = r.status == 0
+
+    return result
+
+def check_users_exist_stream(emails):
+    """Yields (email, True if registered) for every email of the iterable, over a single stream."""
+    requests = (user_service_pb2.UserCheckRequest(email = email) for email in emails)
+
+    for response in get_stub().CheckUsersExistStream(requests):
+        yield response.email, response.status == 0
@@ -0,0 +1,96 @@
+"""Load test di CheckUserExists: latenza p50/p99 e throughput del server grpc.
+
+Da lanciare una volta con GRPC_SERVER_MODE=thread e una con GRPC_SERVER_MODE=aio
+sul server, con gli stessi parametri e mail registrate (POST /register), cosi' ogni richiesta
+passa il bloom filter e interroga il DB, il caso per cui esiste la modalita' aio:
+
+    python benchmarks/load_test.py --target localhost:50051 --concurrency 50 --requests 20000 --emails a@x.com,b@x.com
+
+Con --unregistered si usano mail non registrate, a cui il bloom filter risponde senza DB.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import grpc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src", "grpc_generated"))
+import user_service_pb2, user_service_pb2_grpc
+
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def worker(stub, emails, n, latencies, errors):
+    for i in range(n):
+        start = time.perf_counter()
+
+        try:
+            stub.CheckUserExists(user_service_pb2.UserCheckRequest(email = emails[i % len(emails)]), timeout=10)
+            latencies.append(time.perf_counter() - start)
+        except grpc.RpcError as e:
+            errors.append(e.code().name)
+
+
+def exercised_path(stub, emails):
+    # quante delle mail sono registrate, cioe' quante richieste arrivano al DB
+    response = stub.CheckUsersExist(user_service_pb2.UsersCheckRequest(emails = emails), timeout=30)
+    registrate = sum(1 for result in response.results if result.status == 0)
+
+    if registrate == len(emails):
+        return "DB (tutte le mail sono registrate)"
+    if registrate == 0:
+        return "bloom filter (nessuna mail registrata, il DB non viene interrogato salvo falsi positivi)"
+
+    return f"misto: {registrate}/{len(emails)} mail registrate interrogano il DB"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', default='localhost:50051')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--emails', default='', help="mail registrate separate da virgola")
+    parser.add_argument('--unregistered', action='store_true', help="usa mail non registrate (solo bloom filter)")
+    args = parser.parse_args()
+
+    if args.emails:
+        emails = args.emails.split(',')
+    elif args.unregistered:
+        emails = [f"load-test-{i}@example.com" for i in range(1000)]
+    else:
+        parser.error("--emails con mail registrate obbligatorio (oppure --unregistered)")
+
+    channel = grpc.insecure_channel(args.target)
+    grpc.channel_ready_future(channel).result(timeout=10)
+    stub = user_service_pb2_grpc.CheckUserServiceStub(channel)
+
+    print(f"percorso: {exercised_path(stub, emails)}")
+
+    latencies = []
+    errors = []
+    per_worker = args.requests // args.concurrency
+    threads = [
+        threading.Thread(target=worker, args=(stub, emails, per_worker, latencies, errors))
+        for _ in range(args.concurrency)
+    ]
+
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"richieste: {len(latencies)} ok, {len(errors)} errori in {elapsed:.2f}s ({len(latencies) / elapsed:,.0f} req/s)")
+
+    if latencies:
+        print(f"p50: {percentile(latencies, 50) * 1000:.2f} ms  p99: {percentile(latencies, 99) * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
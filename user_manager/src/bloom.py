@@ -0,0 +1,100 @@
+import math
+import hashlib
+import threading
+from contextlib import contextmanager
+
+
+class BloomFilter:
+    """Bit array con k hash: might_contain() False vuol dire "sicuramente non presente"."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # double hashing: le k posizioni sono ricavate da due hash a 64 bit
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def might_contain(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class UserBloomFilter:
+    """Filtro delle mail registrate, ricostruito periodicamente per assorbire le cancellazioni.
+
+    Finche' non e' stato costruito la prima volta risponde sempre "forse presente",
+    quindi il controllo passa al DB.
+    """
+
+    def __init__(self, error_rate=0.01, min_capacity=10000):
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self._filter = None
+        self._pending = None
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+
+    @staticmethod
+    def normalize(email):
+        # la collation del DB non distingue maiuscole/minuscole e ignora gli spazi finali
+        return email.rstrip(' ').lower()
+
+    def might_contain(self, email):
+        bloom = self._filter
+        return bloom is None or bloom.might_contain(self.normalize(email))
+
+    def add(self, email):
+        email = self.normalize(email)
+
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(email)
+
+            # la mail e' aggiunta anche al filtro in costruzione
+            if self._pending is not None:
+                self._pending.append(email)
+
+    @contextmanager
+    def rebuilding(self):
+        """Apre una ricostruzione: le mail aggiunte da qui in poi finiscono nella lista restituita.
+
+        Va aperta prima di leggere le mail dal DB, cosi' una registrazione successiva alla lettura non si perde.
+        Le ricostruzioni sono eseguite una alla volta.
+        """
+        with self._rebuild_lock:
+            pending = []
+
+            with self._lock:
+                self._pending = pending
+
+            try:
+                yield pending
+            finally:
+                with self._lock:
+                    self._pending = None
+
+    def rebuild(self, count, emails, pending):
+        """count: numero di utenti nel DB, emails: iterabile di tutte le mail, pending: lista di rebuilding()."""
+        bloom = BloomFilter(max(count * 2, self.min_capacity), self.error_rate)
+
+        for email in emails:
+            bloom.add(self.normalize(email))
+
+        with self._lock:
+            for email in pending:
+                bloom.add(email)
+
+            self._filter = bloom
+
+
+user_filter = UserBloomFilter()
@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x12user_service.proto\"!\n\x10UserCheckRequest\x12\r\n\x05\x65mail\x18\x01 \x01(\t\"4\n\x11UserCheckResponse\x12\x0e\n\x06status\x18\x01 \x01(\x05\x12\x0f\n\x07message\x18\x02 \x01(\t2L\n\x10\x43heckUserService\x12\x38\n\x0f\x43heckUserExists\x12\x11.UserCheckRequest\x1a\x12.UserCheckResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x12user_service.proto\"!\n\x10UserCheckRequest\x12\r\n\x05\x65mail\x18\x01 \x01(\t\"C\n\x11UserCheckResponse\x12\x0e\n\x06status\x18\x01 \x01(\x05\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\r\n\x05\x65mail\x18\x03 \x01(\t\"#\n\x11UsersCheckRequest\x12\x0e\n\x06\x65mails\x18\x01 \x03(\t\"9\n\x12UsersCheckResponse\x12#\n\x07results\x18\x01 \x03(\x0b\x32\x12.UserCheckResponse2\xcc\x01\n\x10\x43heckUserService\x12\x38\n\x0f\x43heckUserExists\x12\x11.UserCheckRequest\x1a\x12.UserCheckResponse\x12:\n\x0f\x43heckUsersExist\x12\x12.UsersCheckRequest\x1a\x13.UsersCheckResponse\x12\x42\n\x15\x43heckUsersExistStream\x12\x11.UserCheckRequest\x1a\x12.UserCheckResponse(\x01\x30\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -34,7 +34,11 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_USERCHECKREQUEST']._serialized_start=22
   _globals['_USERCHECKREQUEST']._serialized_end=55
   _globals['_USERCHECKRESPONSE']._serialized_start=57
-  _globals['_USERCHECKRESPONSE']._serialized_end=109
-  _globals['_CHECKUSERSERVICE']._serialized_start=111
-  _globals['_CHECKUSERSERVICE']._serialized_end=187
+  _globals['_USERCHECKRESPONSE']._serialized_end=124
+  _globals['_USERSCHECKREQUEST']._serialized_start=126
+  _globals['_USERSCHECKREQUEST']._serialized_end=161
+  _globals['_USERSCHECKRESPONSE']._serialized_start=163
+  _globals['_USERSCHECKRESPONSE']._serialized_end=220
+  _globals['_CHECKUSERSERVICE']._serialized_start=223
+  _globals['_CHECKUSERSERVICE']._serialized_end=427
 # @@protoc_insertion_point(module_scope)
@@ -26,13 +26,14 @@ if _version_not_supported:
 
 
 class CheckUserServiceStub(object):
-    """questo e' il file .proto in cui si definiscono le funzioni
-    che permettono la comunicazione tra i due microservizi. 
-    questo file contiene una sola funzione: 
-    La funzione permettera' al microservizio Data Manager di inviare
-    una richiesta gRPC al microservizio User Manager. 
-    La funzione ha come parametro la mail da controllare
-    e ha come risposta un booleano. 
+    """questo e' il file .proto in cui si definiscono le funzioni
+    che permettono la comunicazione tra i due microservizi. 
+    Le funzioni permetteranno al microservizio Data Manager di inviare
+    una richiesta gRPC al microservizio User Manager. 
+    CheckUserExists ha come parametro la mail da controllare
+    e ha come risposta un booleano. 
+    CheckUsersExist controlla piu' mail con una sola richiesta,
+    CheckUsersExistStream risponde a ogni mail ricevuta sullo stream. 
 
     """
 
@@ -47,16 +48,27 @@ class CheckUserServiceStub(object):
                 request_serializer=user__service__pb2.UserCheckRequest.SerializeToString,
                 response_deserializer=user__service__pb2.UserCheckResponse.FromString,
                 _registered_method=True)
+        self.CheckUsersExist = channel.unary_unary(
+                '/CheckUserService/CheckUsersExist',
+                request_serializer=user__service__pb2.UsersCheckRequest.SerializeToString,
+                response_deserializer=user__service__pb2.UsersCheckResponse.FromString,
+                _registered_method=True)
+        self.CheckUsersExistStream = channel.stream_stream(
+                '/CheckUserService/CheckUsersExistStream',
+                request_serializer=user__service__pb2.UserCheckRequest.SerializeToString,
+                response_deserializer=user__service__pb2.UserCheckResponse.FromString,
+                _registered_method=True)
 
 
 class CheckUserServiceServicer(object):
-    """questo e' il file .proto in cui si definiscono le funzioni
-    che permettono la comunicazione tra i due microservizi. 
-    questo file contiene una sola funzione: 
-    La funzione permettera' al microservizio Data Manager di inviare
-    una richiesta gRPC al microservizio User Manager. 
-    La funzione ha come parametro la mail da controllare
-    e ha come risposta un booleano. 
+    """questo e' il file .proto in cui si definiscono le funzioni
+    che permettono la comunicazione tra i due microservizi. 
+    Le funzioni permetteranno al microservizio Data Manager di inviare
+    una richiesta gRPC al microservizio User Manager. 
+    CheckUserExists ha come parametro la mail da controllare
+    e ha come risposta un booleano. 
+    CheckUsersExist controlla piu' mail con una sola richiesta,
+    CheckUsersExistStream risponde a ogni mail ricevuta sullo stream. 
 
     """
 
@@ -66,6 +78,18 @@ class CheckUserServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def CheckUsersExist(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def CheckUsersExistStream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_CheckUserServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -74,6 +98,16 @@ def add_CheckUserServiceServicer_to_server(servicer, server):
                     request_deserializer=user__service__pb2.UserCheckRequest.FromString,
                     response_serializer=user__service__pb2.UserCheckResponse.SerializeToString,
             ),
+            'CheckUsersExist': grpc.unary_unary_rpc_method_handler(
+                    servicer.CheckUsersExist,
+                    request_deserializer=user__service__pb2.UsersCheckRequest.FromString,
+                    response_serializer=user__service__pb2.UsersCheckResponse.SerializeToString,
+            ),
+            'CheckUsersExistStream': grpc.stream_stream_rpc_method_handler(
+                    servicer.CheckUsersExistStream,
+                    request_deserializer=user__service__pb2.UserCheckRequest.FromString,
+                    response_serializer=user__service__pb2.UserCheckResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'CheckUserService', rpc_method_handlers)
@@ -83,13 +117,14 @@ def add_CheckUserServiceServicer_to_server(servicer, server):
 
  # This class is part of an EXPERIMENTAL API.
 class CheckUserService(object):
-    """questo e' il file .proto in cui si definiscono le funzioni
-    che permettono la comunicazione tra i due microservizi. 
-    questo file contiene una sola funzione: 
-    La funzione permettera' al microservizio Data Manager di inviare
-    una richiesta gRPC al microservizio User Manager. 
-    La funzione ha come parametro la mail da controllare
-    e ha come risposta un booleano. 
+    """questo e' il file .proto in cui si definiscono le funzioni
+    che permettono la comunicazione tra i due microservizi. 
+    Le funzioni permetteranno al microservizio Data Manager di inviare
+    una richiesta gRPC al microservizio User Manager. 
+    CheckUserExists ha come parametro la mail da controllare
+    e ha come risposta un booleano. 
+    CheckUsersExist controlla piu' mail con una sola richiesta,
+    CheckUsersExistStream risponde a ogni mail ricevuta sullo stream. 
 
     """
 
@@ -119,3 +154,57 @@ class CheckUserService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def CheckUsersExist(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/CheckUserService/CheckUsersExist',
+            user__service__pb2.UsersCheckRequest.SerializeToString,
+            user__service__pb2.UsersCheckResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def CheckUsersExistStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/CheckUserService/CheckUsersExistStream',
+            user__service__pb2.UserCheckRequest.SerializeToString,
+            user__service__pb2.UserCheckResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -4,10 +4,13 @@ from concurrent import futures
 import sys #serve per importare i file pb2 dalla cartella grpc_generated
 import os
 import threading 
+import time
+import asyncio
 import json 
 import redis
 from extensions import db
 from user import User
+from bloom import user_filter
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "grpc_generated"))
 import user_service_pb2
@@ -29,6 +32,30 @@ db.init_app(app)
 
 with app.app_context():
     db.create_all()
+    User.rebuild_filter()
+
+#ogni quanti secondi il bloom filter degli utenti viene ricostruito
+BLOOM_REBUILD_INTERVAL = int(os.getenv('BLOOM_REBUILD_INTERVAL', 3600))
+
+#setup server grpc: "thread" (grpc.server con pool di thread) oppure "aio" (grpc.aio, event loop asyncio)
+GRPC_SERVER_MODE = os.getenv('GRPC_SERVER_MODE', 'thread')
+GRPC_MAX_WORKERS = int(os.getenv('GRPC_MAX_WORKERS', 10))
+#thread usati dal server aio per le query al DB, cosi' l'event loop non si blocca
+GRPC_DB_WORKERS = int(os.getenv('GRPC_DB_WORKERS', 10))
+#oltre questo numero di RPC contemporanee il server risponde RESOURCE_EXHAUSTED (vuoto = nessun limite)
+GRPC_MAX_CONCURRENT_RPCS = int(os.getenv('GRPC_MAX_CONCURRENT_RPCS')) if os.getenv('GRPC_MAX_CONCURRENT_RPCS') else None
+
+grpc_options = [
+    ('grpc.keepalive_time_ms', int(os.getenv('GRPC_KEEPALIVE_TIME_MS', 30000))),
+    ('grpc.keepalive_timeout_ms', int(os.getenv('GRPC_KEEPALIVE_TIMEOUT_MS', 10000))),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.min_ping_interval_without_data_ms', int(os.getenv('GRPC_MIN_PING_INTERVAL_MS', 10000))),
+    #con piu' worker gunicorn ogni processo apre la porta 50051 e il kernel distribuisce le connessioni
+    ('grpc.so_reuseport', 1),
+]
+
+#canale redis su cui ogni worker pubblica le mail registrate, per aggiornare il bloom filter degli altri worker
+USERS_ADDED_CHANNEL = 'users:added'
 
 redis_client = redis.Redis(
     host=os.getenv('REDIS_HOST', 'user-cache'),
@@ -37,6 +64,12 @@ redis_client = redis.Redis(
     decode_responses = True    #converte tutti i dati all'interno della cache redis in stringhe 
 )
 
+def user_check_response(email, esiste):
+    if esiste:
+        return user_service_pb2.UserCheckResponse(status = 0 , message = "UTENTE TROVATO", email = email)
+    else: 
+        return user_service_pb2.UserCheckResponse(status = 1, message = "UTENTE NON TROVATO", email = email)
+
 class CheckUserHandler(user_service_pb2_grpc.CheckUserServiceServicer): 
     def CheckUserExists(self, request, context): 
         email = request.email
@@ -51,10 +84,119 @@ class CheckUserHandler(user_service_pb2_grpc.CheckUserServiceServicer):
             return user_service_pb2.UserCheckResponse(status = 0 , message = "UTENTE TROVATO")
         else: 
             return user_service_pb2.UserCheckResponse(status = 1, message = "UTENTE NON TROVATO")
+
+    def CheckUsersExist(self, request, context):
+        #tutte le mail della richiesta sono controllate con una sola query
+        emails = list(request.emails)
+        print(f"Controllo se esistono {len(emails)} utenti nel DB")
+
+        with app.app_context():
+            esistenti = User.users_exist(emails)
+
+        return user_service_pb2.UsersCheckResponse(
+            results = [user_check_response(email, email in esistenti) for email in emails]
+        )
+
+    def CheckUsersExistStream(self, request_iterator, context):
+        #una risposta per ogni mail ricevuta, nello stesso ordine
+        for request in request_iterator:
+            with app.app_context():
+                esiste = User.user_exist(request.email)
+
+            yield user_check_response(request.email, esiste)
         
 
+def run_in_app_context(function, *args):
+    with app.app_context():
+        return function(*args)
+
+class AsyncCheckUserHandler(user_service_pb2_grpc.CheckUserServiceServicer):
+    #versione per grpc.aio: le query al DB girano nel pool db_executor, le mail escluse dal bloom filter
+    #ricevono risposta direttamente dall'event loop
+    def __init__(self, db_executor):
+        self.db_executor = db_executor
+
+    async def run_db(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.db_executor, run_in_app_context, function, *args)
+
+    async def user_exist(self, email):
+        if not user_filter.might_contain(email):
+            return False
+
+        return await self.run_db(User.user_exist, email)
+
+    async def CheckUserExists(self, request, context):
+        esiste = await self.user_exist(request.email)
+
+        if esiste:
+            return user_service_pb2.UserCheckResponse(status = 0 , message = "UTENTE TROVATO")
+        else: 
+            return user_service_pb2.UserCheckResponse(status = 1, message = "UTENTE NON TROVATO")
+
+    async def CheckUsersExist(self, request, context):
+        emails = list(request.emails)
+        esistenti = await self.run_db(User.users_exist, emails)
+
+        return user_service_pb2.UsersCheckResponse(
+            results = [user_check_response(email, email in esistenti) for email in emails]
+        )
+
+    async def CheckUsersExistStream(self, request_iterator, context):
+        async for request in request_iterator:
+            esiste = await self.user_exist(request.email)
+            yield user_check_response(request.email, esiste)
+
+async def serve_grpc_aio():
+    db_executor = futures.ThreadPoolExecutor(max_workers=GRPC_DB_WORKERS)
+    server = grpc.aio.server(options=grpc_options, maximum_concurrent_rpcs=GRPC_MAX_CONCURRENT_RPCS)
+
+    user_service_pb2_grpc.add_CheckUserServiceServicer_to_server(AsyncCheckUserHandler(db_executor), server)
+
+    server.add_insecure_port('[::]:50051')
+    print("gRPC Server (aio) in ascolto sulla porta 50051...")
+    await server.start()
+    await server.wait_for_termination()
+
+def run_bloom_rebuild():
+    while True:
+        time.sleep(BLOOM_REBUILD_INTERVAL)
+
+        try:
+            with app.app_context():
+                User.rebuild_filter()
+            print("Bloom filter degli utenti ricostruito")
+        except Exception as e:
+            print(f"Errore durante la ricostruzione del bloom filter: {e}")
+
+def run_bloom_sync():
+    # ogni worker ha il proprio bloom filter: le mail registrate dagli altri worker arrivano su redis.
+    # a ogni (ri)connessione il filtro viene ricostruito, cosi' i messaggi persi mentre si era disconnessi non contano
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(USERS_ADDED_CHANNEL)
+
+            with app.app_context():
+                User.rebuild_filter()
+
+            for message in pubsub.listen():
+                user_filter.add(message['data'])
+
+        except Exception as e:
+            print(f"Errore sul canale {USERS_ADDED_CHANNEL}: {e}")
+            time.sleep(5)
+
 def run_grpc_server(): 
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    if GRPC_SERVER_MODE == 'aio':
+        asyncio.run(serve_grpc_aio())
+        return
+
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=GRPC_MAX_WORKERS),
+        options=grpc_options,
+        maximum_concurrent_rpcs=GRPC_MAX_CONCURRENT_RPCS
+    )
 
     user_service_pb2_grpc.add_CheckUserServiceServicer_to_server(CheckUserHandler(), server)
 
@@ -99,6 +241,7 @@ def register_user():
     success = User.add_user(email, nome, cognome)
 
     if success:        
+        redis_client.publish(USERS_ADDED_CHANNEL, email)
         response_body = {              
             "message": "Utente registrato con successo",
             "email_request": email,  
@@ -179,13 +322,28 @@ def delete_user():
 
 
 
-if __name__ == '__main__':
-    
+def init_worker():
+    # inizializzazione di ogni processo, chiamata da gunicorn dopo la fork (post_fork) o da __main__.
+    # le connessioni al DB aperte dal master vengono scartate, i thread partono nel worker
+    with app.app_context():
+        db.engine.dispose(close=False)
+
     """utilizzo un thread per il server grpc in modo tale che quando viene eseguita
     wait_for_termination() non viene bloccato il main thread che gestisce le api request"""
     grpc_thread = threading.Thread(target=run_grpc_server, daemon=True)
     grpc_thread.start()
 
+    bloom_thread = threading.Thread(target=run_bloom_rebuild, daemon=True)
+    bloom_thread.start()
+
+    bloom_sync_thread = threading.Thread(target=run_bloom_sync, daemon=True)
+    bloom_sync_thread.start()
+
+
+if __name__ == '__main__':
+    #server di sviluppo, in produzione l'app e' servita da gunicorn (gunicorn.conf.py)
+    init_worker()
+
     print("REST Server in ascolto sulla porta 5000...")
     app.run(host='0.0.0.0', port=5000, debug=False)
 
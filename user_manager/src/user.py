@@ -1,5 +1,6 @@
 from extensions import db
 from sqlalchemy.exc import IntegrityError
+from bloom import user_filter
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -10,7 +11,26 @@ class User(db.Model):
 
     @classmethod
     def user_exist(cls, email):
-        return cls.query.filter_by(email=email).first() is not None
+        # se il bloom filter dice che la mail non c'e' il DB non viene interrogato,
+        # altrimenti si conferma con una EXISTS senza caricare la riga
+        if not user_filter.might_contain(email):
+            return False
+
+        return db.session.query(db.exists().where(cls.email == email)).scalar()
+
+    @classmethod
+    def users_exist(cls, emails, chunk_size=1000):
+        # una sola query IN ogni chunk_size mail, ritorna l'insieme delle mail richieste che sono registrate,
+        # scritte come le ha passate il chiamante: la IN non distingue maiuscole/minuscole e spazi finali,
+        # quindi le mail del DB sono confrontate dopo la stessa normalizzazione del bloom filter
+        candidate = [email for email in emails if user_filter.might_contain(email)]
+        trovate = set()
+
+        for i in range(0, len(candidate), chunk_size):
+            stmt = db.select(cls.email).where(cls.email.in_(candidate[i:i + chunk_size]))
+            trovate.update(map(user_filter.normalize, db.session.execute(stmt).scalars()))
+
+        return {email for email in candidate if user_filter.normalize(email) in trovate}
 
     @classmethod
     def add_user(cls, email, nome, cognome):
@@ -20,6 +40,7 @@ class User(db.Model):
             
             db.session.add(new_user)
             db.session.commit()
+            user_filter.add(email)
             
             print("UTENTE CORRETTAMENTE INSERITO NELLA TABELLA")
             return True
@@ -34,6 +55,15 @@ class User(db.Model):
             print(f"Errore sconosciuto SQL: {e}")
             return False
 
+    @classmethod
+    def rebuild_filter(cls):
+        # le mail cancellate escono dal filtro solo quando viene ricostruito.
+        # le letture dal DB avvengono dentro rebuilding(), le mail registrate nel frattempo non vanno perse
+        with user_filter.rebuilding() as pending:
+            count = db.session.query(db.func.count(cls.email)).scalar()
+            emails = db.session.execute(db.select(cls.email).execution_options(yield_per=10000)).scalars()
+            user_filter.rebuild(count, emails, pending)
+
     @classmethod
     def delete_user(cls, email):
         try: